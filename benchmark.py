@@ -0,0 +1,539 @@
+"""
+Benchmarks for the watering pipeline, run with `python benchmark.py <benchmark> [options]`
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Coroutine, List, Union
+
+from botAPI import WateringCan, CommandError, BotAuthor, ChannelReader, _decode, _parse_watering_message, \
+    _parse_exp_message, _parse_shop_message, _parse_plants_message, _parse_time_message
+
+from simulator import Simulator, VirtualFarm
+from breaker import CircuitBreaker
+from policy import POLICIES, LearnedCooldownPolicy
+from profiling import PROFILER
+from ratelimit import RateLimiter
+
+import botAPI
+import flower_messages
+import aiohttp
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import pstats
+import random
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import requests
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """
+    Answers the two discord endpoints used by the watering can with canned responses
+    """
+    protocol_version = "HTTP/1.1"  # allows keep-alive
+    disable_nagle_algorithm = True
+    wbufsize = -1  # headers and body go out in a single write
+    message_ids = itertools.count(1)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("content-length", 0)))
+        self._send({"id": str(next(self.message_ids))})
+
+    def do_GET(self):
+        self._send([{"author": {"username": "Flower", "id": "2", "bot": True}, "embeds": [{"description": "watered"}],
+                     "content": ""}])
+
+    def _send(self, body):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_stand_in() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _measure(command: Callable[[], None], n: int) -> List[float]:
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        command()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _report(name: str, samples: List[float]):
+    samples = sorted(samples)
+    print(f"{name:<12} mean={statistics.mean(samples) * 1000:.3f}ms "
+          f"p50={samples[len(samples) // 2] * 1000:.3f}ms "
+          f"p95={samples[int(len(samples) * .95)] * 1000:.3f}ms")
+
+
+def bench_http(args):
+    """
+    Per command latency (send command + read feedback) of new connections per request against the pooled session.
+    The stand-in uses plain http, so the savings of skipping the TLS handshake against discord are not included, and
+    answers without rate limits, so the pooled requests are not held back by the global limit either.
+    """
+    server = _start_stand_in()
+    endpoint = f"http://127.0.0.1:{server.server_port}"
+
+    with WateringCan("token", 1, endpoint=endpoint, rate_limiter=RateLimiter(global_limit=math.inf)) as wc:
+        def unpooled():
+            headers = wc.can._build_discord_header_data()
+            r = requests.post(f"{endpoint}/channels/1/messages", headers=headers, json={"content": "p.exp"})
+            requests.get(f"{endpoint}/channels/1/messages", headers=headers, params={"after": r.json()["id"]})
+
+        def pooled():
+            wc._run(wc.can._get_messages(wc._run(wc.can._issue_command("p.exp"))))
+
+        for name, command in (("unpooled", unpooled), ("pooled", pooled)):
+            command()  # warm up
+            _report(name, _measure(command, args.n))
+
+    server.shutdown()
+
+
+def bench_pipeline(args):
+    """
+    Waters every plant of a simulated farm once, through the whole watering pipeline (rate limiting, sending, reply
+    reading and parsing), reporting throughput, per watering latency and the simulator request counts
+    """
+    rate_limit = (int(args.rate_limit[0]), args.rate_limit[1]) if args.rate_limit else None
+    never_open = CircuitBreaker(failure_threshold=args.plants + 1)  # injected errors do not pause the run
+
+    with Simulator(args.plants, tuple(args.latency), args.error_rate, rate_limit) as sim, \
+            WateringCan("token", sim.channel, pool_size=args.workers, endpoint=sim.endpoint, breaker=never_open) as wc:
+        def water(name: str) -> float:
+            start = time.perf_counter()
+            try:
+                result = wc.water_plant(name)
+            except CommandError:
+                return -1
+            return time.perf_counter() - start if result[0] else -1
+
+        async def water_async(name: str, slots: asyncio.Semaphore) -> float:
+            async with slots:
+                start = time.perf_counter()
+                try:
+                    result = await wc.can.water_plant(name)
+                except CommandError:
+                    return -1
+                return time.perf_counter() - start if result[0] else -1
+
+        async def water_all() -> List[float]:
+            slots = asyncio.Semaphore(args.workers)
+            return await asyncio.gather(*(water_async(name, slots) for name in sim.bot.plants.keys()))
+
+        start = time.perf_counter()
+        if args.asyncio:  # every watering in flight on the watering can event loop
+            latencies = wc._run(water_all())
+        else:
+            with ThreadPoolExecutor(args.workers) as pool:
+                latencies = list(pool.map(water, sim.bot.plants.keys()))
+        elapsed = time.perf_counter() - start
+
+        watered = [latency for latency in latencies if latency >= 0]
+        print(f"watered {len(watered)}/{len(latencies)} plants in {elapsed:.2f}s "
+              f"({len(watered) / elapsed:.1f} waterings/s) with {args.workers} "
+              f"{'concurrent commands on one event loop' if args.asyncio else 'worker threads'}")
+        if watered:
+            _report("watering", watered)
+        print(", ".join(f"{stat}={count}" for stat, count in sim.stats.items()))
+
+
+PARSERS = {
+    "water": _parse_watering_message,
+    "wait": _parse_watering_message,
+    "exp": _parse_exp_message,
+    "shop": _parse_shop_message,
+    "plants": _parse_plants_message,
+    "time": _parse_time_message,
+}
+
+
+PARSE_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parse_baseline.json")
+
+_calibration_parser = re.compile(r"level (\d+)/(\d+)")
+_calibration_text = "**Sunflower** plant, level 3/10. Dies in **2 hours** if not watered."
+
+
+def _calibration():
+    """
+    A fixed regex and int conversion workload, timed alongside the parsers to tell how fast the machine parses
+    """
+    match = _calibration_parser.search(_calibration_text)
+    return int(match[1]), int(match[2])
+
+
+def bench_parse(args):
+    """
+    Parse throughput per message type over the sample corpus, relative to a fixed calibration workload timed in turns
+    with it, so the results compare across machines and load changes. The run fails when a message type got slower
+    than the baseline (parse_baseline.json by default, see --compare) by more than --tolerance, --save stores the
+    results as the new baseline.
+    Note the corpus is synthetic, built by flower_messages in the shapes of the bot messages.
+    """
+    results = {}
+
+    for message_type, samples in flower_messages.corpus().items():
+        parser = PARSERS[message_type]
+
+        def parse_all():
+            for sample in samples:
+                parser(sample)
+
+        number = args.n // len(samples) or 1
+        parse_best = calibration_best = float("inf")
+        for _ in range(args.repeat):  # in turns, so a slowdown of the machine affects both
+            parse_best = min(parse_best, timeit.timeit(parse_all, number=number))
+            calibration_best = min(calibration_best, timeit.timeit(_calibration, number=number * len(samples)))
+
+        rate = number * len(samples) / parse_best
+        results[message_type] = calibration_best / parse_best
+        print(f"{message_type:<8} {rate:>12,.0f} messages/s {results[message_type]:>8.4f} x calibration")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    if args.compare and not args.save:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+
+        regressions = [t for t, rate in results.items() if t in baseline and rate < baseline[t] * (1 - args.tolerance)]
+        for message_type in regressions:
+            print(f"REGRESSION {message_type}: {results[message_type]:.4f} < {baseline[message_type]:.4f} "
+                  f"x calibration")
+        if regressions:
+            sys.exit(1)
+        print(f"no message type slower than {args.compare} by more than {args.tolerance:.0%}")
+
+
+def _recorded_page(size: int) -> List[dict]:
+    """
+    :param size: the number of messages
+    :return: a channel messages page with the users commands followed by the bot replies, newest first
+    """
+    corpus = flower_messages.corpus()
+    replies = list(itertools.chain.from_iterable(corpus[t] for t in ("water", "wait", "exp", "plants")))
+    page = []
+    for i in range(size // 2):
+        page.append({"id": str(2 * i + 1), "author": {"username": "user", "id": "1"}, "content": "p.water plant",
+                     "embeds": []})
+        page.append(dict(replies[i % len(replies)], id=str(2 * i + 2)))
+    return page[::-1]
+
+
+def bench_poll(args):
+    """
+    CPU cost of a single poll of the channel messages: decoding the page and picking the bot messages out of it. A
+    full default page matched by bot name is compared against a page sized to the pending commands matched by bot id.
+    A recorded page (a saved GET messages response) can be given with --page.
+    """
+    if args.page:
+        with open(args.page, "rb") as f:
+            full = f.read()
+    else:
+        full = json.dumps(_recorded_page(50)).encode()
+    messages = json.loads(full)
+    small = json.dumps(messages[-ChannelReader.MESSAGES_PER_COMMAND * (args.pending + 1):]).encode()
+
+    def response(body: bytes) -> requests.Response:
+        r = requests.Response()
+        r._content, r.encoding, r.status_code = body, "utf-8", 200
+        return r
+
+    bot = BotAuthor()
+    bot([m for m in messages if bot.name == m["author"].get("username") and m["author"].get("bot")][0])
+
+    def by_name():
+        return [m for m in response(full).json() if m["author"]["username"] == "Flower"]
+
+    def by_id_json():
+        return [m for m in json.loads(response(small).content) if bot(m)]
+
+    def by_id():
+        return [m for m in _decode(small) if bot(m)]
+
+    print(f"page of {len(messages)} messages ({len(full):,} bytes) against {len(json.loads(small))} messages "
+          f"({len(small):,} bytes) for {args.pending} pending commands")
+    polls = [("full+name", by_name), ("sized+id", by_id_json)]
+    if botAPI.orjson is not None:
+        polls.append(("sized+id+orjson", by_id))
+    for name, poll in polls:
+        best = min(timeit.repeat(poll, number=args.n, repeat=5)) / args.n
+        print(f"{name:<16} {best * 1e6:>10.1f}us per poll")
+
+
+def _wait_for(condition: Callable[[], bool], timeout: float) -> Union[float, None]:
+    """
+    :return: seconds until the condition held, None if it did not within the timeout
+    """
+    start = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start > timeout:
+            return None
+        time.sleep(.05)
+    return time.perf_counter() - start
+
+
+def bench_gateway(args):
+    """
+    Runs the gateway receive mode against the gateway stand-in through the connection troubles it has to recover from
+    (reconnect request, dropped connection, zombie connection, invalidated session), watering a batch of plants
+    around each one. Reports how long the listener took to be live again, how it got back (resume or identify) and
+    the channel reads, failing if a watering got no reply or the session was not recovered as expected.
+    """
+    plants = args.plants if args.plants < 1000 else 40  # the default is sized for the pipeline
+    with Simulator(plants, tuple(args.latency), gateway_port=0, heartbeat_interval=args.heartbeat) as sim, \
+            WateringCan("token", sim.channel, endpoint=sim.endpoint, receive_mode="gateway",
+                        gateway_url=sim.gateway.url, feedback_timeout=10) as wc:
+        listener = wc.can.gateway
+        names = iter(list(sim.bot.plants))
+        batch = max(plants // 5, 1)
+
+        def water_batch() -> int:
+            with ThreadPoolExecutor(batch) as pool:
+                results = list(pool.map(lambda name: wc.water_plant(name)[0], itertools.islice(names, batch)))
+            return sum(results)
+
+        def zombie():
+            sim.gateway.ack_heartbeats = False
+            _wait_for(lambda: not listener.is_connected(), args.heartbeat * 3)
+            sim.gateway.ack_heartbeats = True
+
+        troubles = [
+            ("connect", lambda: None, "identifies"),
+            ("reconnect", sim.gateway.reconnect, "resumes"),
+            ("drop", sim.gateway.drop, "resumes"),
+            ("zombie", zombie, "resumes"),
+            ("invalidate", sim.gateway.invalidate, "identifies"),
+        ]
+
+        failed = False
+        print(f"{'trouble':<12} {'live after':>10} {'recovered by':>13} {'watered':>8} {'reads':>6}")
+        for name, trouble, expected in troubles:
+            stats = dict(sim.gateway.stats)
+            gets = sim.stats["gets"]
+            trouble()
+            watered = water_batch()  # sent while the listener recovers, replies are read or replayed on resume
+            live_after = _wait_for(listener.is_connected, 30)
+            recovered = [stat for stat in ("identifies", "resumes") if sim.gateway.stats[stat] > stats[stat]]
+
+            ok = live_after is not None and watered == batch and recovered == [expected]
+            failed |= not ok
+            print(f"{name:<12} {'never' if live_after is None else f'{live_after:.1f}s':>10} "
+                  f"{'/'.join(recovered) or 'nothing':>13} {watered:>5}/{batch:<2} {sim.stats['gets'] - gets:>6}"
+                  f"{'' if ok else '  FAILED'}")
+
+        print(", ".join(f"{stat}={count}" for stat, count in sim.gateway.stats.items()))
+    if failed:
+        sys.exit(1)
+
+
+def bench_probe(args):
+    """
+    Checks the rate limiter around requests getting no response and routes without rate limits: a dropped command
+    send or channel read must not keep the next requests of its route waiting for the limits to be learned, and a
+    route answered without rate limit headers must let requests through concurrently. Fails if any does not hold.
+    """
+    timeout = 5
+    never_open = CircuitBreaker(failure_threshold=100)
+    failed = False
+
+    def report(name: str, ok: bool, detail: str):
+        nonlocal failed
+        failed |= not ok
+        print(f"{name:<24} {detail}{'' if ok else '  FAILED'}")
+
+    def command_after(wc: WateringCan, sim: Simulator, dropped: Coroutine, errors: tuple) -> str:
+        """
+        :return: how the command sent right after a dropped request went
+        """
+        sim.drop_rate = 1
+        try:
+            wc._run(dropped)
+        except errors:
+            pass
+        sim.drop_rate = 0
+        start = time.perf_counter()
+        try:
+            asyncio.run_coroutine_threadsafe(wc.can.get_exp(), wc.loop).result(timeout)
+        except FutureTimeoutError:
+            return f"still blocked after {timeout}s"
+        except CommandError as e:
+            return f"failed: {e}"
+        return f"replied in {time.perf_counter() - start:.2f}s"
+
+    with Simulator(1, (.05, .1)) as sim:
+        for name, request, errors in (
+                ("dropped command", lambda wc: wc.can.get_exp(), (CommandError,)),
+                ("dropped channel read", lambda wc: wc.can._get_messages(0, 1), (aiohttp.ClientError,))):
+            with WateringCan("token", sim.channel, endpoint=sim.endpoint, feedback_timeout=2, breaker=never_open) as wc:
+                outcome = command_after(wc, sim, request(wc), errors)
+                report(name, outcome.startswith("replied"), outcome)
+
+        with WateringCan("token", sim.channel, endpoint=sim.endpoint, breaker=never_open) as wc:
+            route = f"GET /channels/{sim.channel}/messages"
+            wc._run(wc.can._get_messages(0, 1))  # answered without rate limit headers
+
+            async def two_in_flight():
+                await wc.can.rate_limiter.acquire_async(route)
+                await asyncio.wait_for(wc.can.rate_limiter.acquire_async(route), 1)
+
+            try:
+                wc._run(two_in_flight())
+                report("unlimited route", True, "requests sent concurrently")
+            except asyncio.TimeoutError:
+                report("unlimited route", False, "requests sent one at a time")
+
+    if failed:
+        sys.exit(1)
+
+
+def bench_profile(args):
+    """
+    Checks the profiling of the waterings: a profiled p.water must profile the request and the reply parsing, which run
+    on the event loop thread of the watering can, and tag their stacks with the plant and command sections. Fails if
+    either is missing.
+    """
+    failed = False
+    seen = {}  # function -> the stacks it ran in, as the profiler samples them
+
+    def report(name: str, ok: bool, detail: str):
+        nonlocal failed
+        failed |= not ok
+        print(f"{name:<32} {detail}{'' if ok else '  FAILED'}")
+
+    def stack() -> str:
+        return PROFILER._collapse(threading.get_ident(), sys._getframe(1))
+
+    def parse_watering(message: dict):
+        seen.setdefault("_parse_watering_message", []).append(stack())
+        return _parse_watering_message(message)
+
+    with Simulator(1, (.01, .02), cooldown=0) as sim, tempfile.TemporaryDirectory() as directory, \
+            WateringCan("token", sim.channel, endpoint=sim.endpoint) as wc:
+        request = wc.can._request
+
+        async def traced_request(*request_args, **kwargs):
+            seen.setdefault("_request", []).append(stack())
+            return await request(*request_args, **kwargs)
+
+        wc.can._request = traced_request
+        botAPI._parse_watering_message = parse_watering
+        plant = next(iter(sim.bot.plants))
+        PROFILER.directory = directory
+        PROFILER.start(60)
+        try:
+            with PROFILER.section(f"plant:{plant}"):
+                for _ in range(5):
+                    wc.water_plant(plant)
+        finally:
+            files = PROFILER.stop()
+            botAPI._parse_watering_message = _parse_watering_message
+
+        profiled = {function for _, _, function in pstats.Stats(files[0]).stats} if len(files) > 1 else set()
+        prefix = f"plant:{plant};command:p.water;"
+        for function in ("_request", "_parse_watering_message"):
+            report(f"profiled {function}", function in profiled,
+                   "in the pstats file" if function in profiled else "missing from the pstats file")
+            stacks = seen.get(function, [])
+            tagged = sum(s.startswith(prefix) for s in stacks)
+            report(f"tagged {function}", tagged > 0, f"{tagged}/{len(stacks)} stacks under {prefix[:-1]}")
+
+        with open(files[-1]) as f:
+            untagged = sum(int(line.rsplit(" ", 1)[1]) for line in f
+                           if line.startswith("_bootstrap") and "run_forever" in line and "(botAPI.py" in line)
+        report("untagged event loop samples", untagged == 0, f"{untagged} running the watering can")
+
+    if failed:
+        sys.exit(1)
+
+
+def bench_policy(args):
+    """
+    Compares the watering policies on a virtual farm: the same scheduler and bot model run over days of simulated
+    time, counting the commands rejected for being sent during a cooldown (wasted), the seconds plants were ready to be
+    watered but were not (idle), the command rate and the plant deaths.
+    """
+    print(f"{args.plants} plants for {args.days} days, bot cooldown {args.cooldown}s, "
+          f"death time {args.death_time}s, rate {args.rate or 'unlimited'}/s")
+    print(f"{'policy':<10} {'commands':>10} {'wasted':>8} {'idle/watering':>14} {'rate/s':>8} {'peak/min':>9} "
+          f"{'deaths':>7} {'time':>7}")
+    for name in args.policy or POLICIES:
+        options = {"probe_every": args.probe_every} if issubclass(POLICIES[name], LearnedCooldownPolicy) else {}
+        farm = VirtualFarm(args.plants, POLICIES[name](rng=random.Random(args.seed), **options), args.rate,
+                           args.cooldown, args.death_time)
+        start = time.perf_counter()
+        stats = farm.run(args.days * 86400)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<10} {stats['commands']:>10} {stats['wasted']:>8} "
+              f"{stats['idle_seconds'] / max(stats['watered'], 1):>13.1f}s {stats['rate']:>8.2f} "
+              f"{stats['peak_per_minute']:>9} {stats['deaths']:>7} {elapsed:>6.1f}s")
+
+
+BENCHMARKS = {
+    "gateway": bench_gateway,
+    "http": bench_http,
+    "parse": bench_parse,
+    "pipeline": bench_pipeline,
+    "poll": bench_poll,
+    "probe": bench_probe,
+    "profile": bench_profile,
+    "policy": bench_policy,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=BENCHMARKS.keys())
+    parser.add_argument("-n", type=int, default=500, help="iterations")
+    parser.add_argument("--save", help="file to save the results to as a baseline, e.g. parse_baseline.json (parse)")
+    parser.add_argument("--compare", default=PARSE_BASELINE,
+                        help="baseline file to check the results against, empty to not check (parse)")
+    parser.add_argument("--tolerance", type=float, default=.3, help="allowed slowdown against the baseline (parse)")
+    parser.add_argument("--repeat", type=int, default=15, help="timings each result is the best of (parse)")
+    parser.add_argument("--plants", type=int, default=1000, help="simulated plants (pipeline, policy, gateway)")
+    parser.add_argument("--workers", type=int, default=32, help="concurrent waterings (pipeline)")
+    parser.add_argument("--latency", type=float, nargs=2, default=(.2, .6), metavar=("MIN", "MAX"),
+                        help="bot reply latency range (pipeline, gateway)")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="run the waterings as coroutines instead of worker threads (pipeline)")
+    parser.add_argument("--error-rate", type=float, default=0, help="server error probability (pipeline)")
+    parser.add_argument("--pending", type=int, default=4, help="commands waiting for their reply (poll)")
+    parser.add_argument("--page", help="recorded messages page to decode (poll)")
+    parser.add_argument("--rate-limit", type=float, nargs=2, default=None, metavar=("REQUESTS", "WINDOW"),
+                        help="requests allowed per route and window (pipeline)")
+    parser.add_argument("--policy", action="append", choices=POLICIES.keys(),
+                        help="watering policy to run, can be repeated, all by default (policy)")
+    parser.add_argument("--days", type=float, default=2, help="simulated days (policy)")
+    parser.add_argument("--rate", type=float, default=None, help="maximum waterings started per second (policy)")
+    parser.add_argument("--cooldown", type=float, default=900, help="bot watering cooldown in seconds (policy)")
+    parser.add_argument("--death-time", type=float, default=2 * 86400,
+                        help="seconds a plant survives without water (policy)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (policy)")
+    parser.add_argument("--probe-every", type=int, default=0,
+                        help="successes between cooldown checks of the learned policy, 0 for none (policy)")
+    parser.add_argument("--heartbeat", type=float, default=1, help="gateway heartbeat interval in seconds (gateway)")
+
+    bench_args = parser.parse_args()
+    BENCHMARKS[bench_args.benchmark](bench_args)
@@ -1,19 +1,105 @@
-from typing import Union, Callable, Tuple, List, Dict
-
-import requests
+from typing import Union, Callable, Coroutine, Awaitable, Tuple, List, Dict
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+
+from ratelimit import RateLimiter
+from breaker import CircuitBreaker
+from metrics import Counter, Gauge, Histogram
+from profiling import PROFILER
+
+import aiohttp
+import asyncio
+import gateway
+import json
+import threading
 import time
-import datetime
 import logging
-import parse
+import math
+import re
+
+try:
+    import orjson
+except ImportError:  # the standard json decoder is used
+    orjson = None
 
 log = logging.getLogger(__name__)
 
 __version__ = 'beta 0.1'
 
-_wait_message_parser = parse.Parser("You need to wait another {val} to {}")
-_exp_message_parser = parse.Parser("{}**{val}**{}")
-_plant_info_message_parser = \
-    parse.Parser("**{type}**{}level {level}/{max_level}.{}**{death_timer}**{}**{alive_time}**{}")
+# parsers are compiled once, when the module is loaded
+# the parts of a time span, the words between them are skipped ("and"), or else caught (in the last group)
+_duration_parser = re.compile(r"(?:(\d+(?:\.\d+)?)\s*|\b(an?)\s+)"
+                              r"(days?|hours?|hrs?|minutes?|mins?|seconds?|secs?|[dhms])\b"
+                              r"|\band\b|([^\s,.])", re.IGNORECASE)
+_wait_message_parser = re.compile(r"You need to wait another (?P<val>.+?) to ")
+_exp_message_parser = re.compile(r"\*\*(?P<val>[\d,]+)\*\*")
+_plant_info_message_parser = re.compile(r"\*\*(?P<type>.+?)\*\*.*?level (?P<level>\d+)/(?P<max_level>\d+)\..*?"
+                                        r"\*\*(?P<death_timer>.+?)\*\*.*?\*\*(?P<alive_time>.+?)\*\*", re.DOTALL)
+
+_duration_units = {"d": 86400, "h": 3600, "m": 60, "s": 1}
+
+# metrics
+_command_send_seconds = Histogram("flower_command_send_seconds", "Time to send a command", ("command",))
+_commands_total = Counter("flower_commands_total", "Commands issued", ("command", "result"))
+_messages_read_seconds = Histogram("flower_messages_read_seconds", "Time to read the channel messages")
+_reply_wait_seconds = Histogram("flower_reply_wait_seconds", "Time from issuing a command to its bot reply",
+                                ("command",))
+_parse_seconds = Histogram("flower_parse_seconds", "Time to parse a bot reply", ("parser",),
+                           (.00001, .000025, .00005, .0001, .00025, .0005, .001, .0025, .005, .01))
+_rate_limit_queue = Gauge("flower_rate_limit_queue_depth", "Requests waiting for a rate limit slot")
+
+
+class CommandError(Exception):
+    """
+    A bot command that did not get a usable reply
+    """
+
+    def __init__(self, command: str, reason: str):
+        """
+        :param command: the command
+        :param reason: why it failed
+        """
+        super(CommandError, self).__init__(f"\"{command}\": {reason}")
+        self.command = command
+        self.reason = reason
+
+
+class SendError(CommandError):
+    """
+    The command could not be sent
+    """
+
+    def __init__(self, command: str, reason: str, status: int = None):
+        """
+        :param status: the http status of the send, None if there was no response
+        """
+        super(SendError, self).__init__(command, reason)
+        self.status = status
+
+
+class NoReplyError(CommandError):
+    """
+    The command was sent but the bot did not reply in time
+    """
+
+
+class BadReplyError(CommandError):
+    """
+    The bot reply could not be read, like a reply to another command or in an unknown format
+    """
+
+
+class CircuitOpenError(CommandError):
+    """
+    The command was not sent, commands are paused after too many failures
+    """
+
+    def __init__(self, command: str, retry_at: float):
+        """
+        :param retry_at: the time commands are tried again at
+        """
+        super(CircuitOpenError, self).__init__(command, "commands are paused")
+        self.retry_at = retry_at
 
 
 class Plant(object):
@@ -21,13 +107,33 @@ class Plant(object):
     Represents a plant
     """
 
-    def __init__(self, name: str, plant_type: str, level: int, max_level: int, death_timer: str, alive_time: str):
+    __slots__ = ("name", "type", "level", "max_level", "death_timer", "alive_time", "fetched_at")
+
+    def __init__(self, name: str, plant_type: str, level: int, max_level: int, death_timer: int, alive_time: int,
+                 fetched_at: float = None):
+        """
+        :param name: the plant name
+        :param plant_type: the plant type
+        :param level: the plant nourishment level
+        :param max_level: the plant max nourishment level
+        :param death_timer: seconds until the plant dies if not watered
+        :param alive_time: seconds the plant has been alive for
+        :param fetched_at: the time the timers were read at, defaults to now
+        """
         self.name = name
         self.type = plant_type
         self.level = level
         self.max_level = max_level
-        self.death_timer = death_timer  # _parse_time_message(death_timer)
-        self.alive_time = alive_time  # _parse_time_message(alive_time)
+        self.death_timer = death_timer
+        self.alive_time = alive_time
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+
+    @property
+    def death_at(self) -> float:
+        """
+        :return: the time the plant dies at if not watered
+        """
+        return self.fetched_at + self.death_timer
 
     def __repr__(self):
         return f"Plant[name={self.name}, type={self.type}, level={self.level}/{self.max_level}]"
@@ -35,62 +141,48 @@ class Plant(object):
     def __str__(self):
         return f"Name: {self.name} ({self.type})\n" \
                f"Nourishment {self.level}/{self.max_level}\n" \
-               f"Alive for {self.alive_time}\n" \
-               f"Death in {self.death_timer} if not watered\n"
-
-
-def _parse_time_message(message: str) -> time.struct_time:
-    log.debug(f"Parsing time message: {message}")
-
-    parseFormat = ""
-
-    if "days" in message:
-        parseFormat += " {day} days"
-    if "hours" in message:
-        parseFormat += " {hour} hours"
-    if "minutes" in message:
-        parseFormat += " {minute} minutes"
-    if "seconds" in message:
-        parseFormat += " {second} seconds"
+               f"Alive for {self.alive_time} seconds\n" \
+               f"Death in {self.death_timer} seconds if not watered\n"
 
-    parseFormat = parseFormat.strip()
-    message = message.strip()
 
-    p = parse.parse(parseFormat, message)
-    keys: dict = p.named.keys()
-
-    day = p["day"] if "day" in keys else 1
-    hour = p["hour"] if "hour" in keys else 0
-    minute = p["minute"] if "minute" in keys else 0
-    second = p["second"] if "second" in keys else 0
+def _parse_time_message(message: str) -> Union[int, None]:
+    """
+    Parses a time span, either long ("1 day 2 hours 3 minutes 4 seconds", "an hour"), abbreviated ("2 mins 3 secs") or
+    short ("2h 3m 4s") formatted
+    :param message: the time span to parse
+    :return: the time span in seconds, rounded up, None if the message is not (only) a time span
+    """
+    log.debug("Parsing time message: %s", message)
 
-    return datetime.datetime(1990, 1, day=int(day), hour=int(hour), minute=int(minute), second=int(second))
+    seconds = None
+    for value, _, unit, unknown in _duration_parser.findall(message):
+        if unknown:
+            return None  # words the parser does not know
+        if unit:
+            seconds = (seconds or 0) + (float(value) if value else 1) * _duration_units[unit[0].lower()]
+    return None if seconds is None else math.ceil(seconds)
 
 
-def _parse_watering_message(message: dict) -> \
-        Union[Tuple[bool, Union[time.struct_time, time.struct_time]], Tuple[bool, None]]:
+def _parse_watering_message(message: dict) -> Union[Tuple[bool, int], Tuple[bool, None]]:
     """
     Parses the watering message
     :param message: the message to parse
-    :return: a tuple containing (watering result [True/False], wait time)
+    :return: a tuple containing (watering result [True/False], wait time in seconds)
     """
-    log.debug(f"Parsing wait message: {message}")
+    log.debug("Parsing wait message: %s", message)
 
     if message.get("embeds"):
         return True, None
 
     if message.get("content"):  # too soon (get cooldown from bot feedback and wait)
-        p = _wait_message_parser.parse(message["content"])
-        m: str = p["val"]
-
-        if len(m.split(" ")) > 1:
-            t = time.strptime(m, "%Mm %Ss")
-        else:
-            t = time.strptime(m, "%Ss" if "s" in m else "%Mm")
+        p = _wait_message_parser.match(message["content"])
 
-        return False, t
+        if p:
+            wait = _parse_time_message(p["val"])
+            if wait is not None:
+                return False, wait
 
-    log.error(f"Unexpected call on _parse_wait_message, message: {message}")
+    log.error("Unexpected call on _parse_wait_message, message: %s", message)
     return False, None
 
 
@@ -101,17 +193,20 @@ def _parse_exp_message(message: dict) -> Union[int, None]:
     :return: the exp integer value contained in the message
     """
 
-    log.debug(f"Parsing exp message: {message}")
-    return int(_exp_message_parser.parse(message["embeds"][0]["description"])["val"].replace(",", ""))
+    log.debug("Parsing exp message: %s", message)
+
+    p = _exp_message_parser.search(message["embeds"][0]["description"])
+    return int(p["val"].replace(",", "")) if p else None
 
 
 def _parse_shop_message(message: dict) -> Union[dict, None]:
     """
     Parses the shop message
     :param message: the message to parse
-    :return: a dictionary representing the shop offers and their prices in the format {offer: exp_price}
+    :return: a dictionary representing the shop offers and their prices in the format {offer: exp_price}, prices are
+    integers when numeric
     """
-    log.debug(f"Parsing shop message: {message}")
+    log.debug("Parsing shop message: %s", message)
 
     fields = message.get("embeds")[0].get("fields")
 
@@ -127,11 +222,10 @@ def _parse_shop_message(message: dict) -> Union[dict, None]:
     shop = {}
 
     for item in shop_items:
-        item = item.replace('~', '', -1)
-        item = item.replace('`', '', -1)
-        item = item.split(" - ")
+        offer, price = item.replace("~", "").replace("`", "").split(" - ", 1)
+        price = price.replace(",", "")
 
-        shop.update({item[0]: item[1]})
+        shop[offer] = int(price) if price.isdigit() else price
 
     return shop
 
@@ -142,77 +236,493 @@ def _parse_plants_message(message: dict) -> List[Plant]:
     :param message: the message to parse
     :return: a list of the plants specified in the message
     """
-    log.debug(f"Parsing plants message: {message}")
+    log.debug("Parsing plants message: %s", message)
 
     u_plants: List[Dict[str, str]] = message.get("embeds")[0].get("fields")
 
     _plants = []
+    now = time.time()
 
     for u_plant in u_plants:
         name = u_plant.get("name")
-        info = _plant_info_message_parser.parse(u_plant.get("value"))
-        _plants.append(
-            Plant(name, info["type"], int(info["level"]), int(info["max_level"]), info["death_timer"], info["alive_time"]))
+        info = _plant_info_message_parser.search(u_plant.get("value"))
+        death_timer, alive_time = _parse_time_message(info["death_timer"]), _parse_time_message(info["alive_time"])
+        if death_timer is None or alive_time is None:
+            raise ValueError(f"Unknown time span in the plant {name}: {u_plant.get('value')!r}")
+        _plants.append(Plant(name, info["type"], int(info["level"]), int(info["max_level"]), death_timer, alive_time,
+                             now))
 
     return _plants
 
 
-class WateringCan:
+def _snowflake_time(snowflake: Union[int, str]) -> float:
+    """
+    :param snowflake: a discord id
+    :return: the creation time of the object with the given id in seconds since the discord epoch
+    """
+    return (int(snowflake) >> 22) / 1000
+
+
+class LatencyEstimator:
+    """
+    Keeps the latest bot reply latencies and estimates their percentiles
+    """
+
+    def __init__(self, initial: float = 1, size: int = 100):
+        """
+        :param initial: latency assumed while no samples were taken
+        :param size: how many of the latest samples are kept
+        """
+        self.initial = initial
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, q: float) -> float:
+        """
+        :param q: the percentile to estimate, between 0 and 1
+        :return: the estimated latency in seconds
+        """
+        with self._lock:
+            if not self._samples:
+                return self.initial
+            samples = sorted(self._samples)
+
+        return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+
+class BotAuthor:
+    """
+    Tells the bot messages apart by their author id. The id is either given or learned from the first message sent by
+    a bot account with the bot name.
+    """
+
+    def __init__(self, name: str = "Flower", bot_id: str = None):
+        """
+        :param name: the bot username, used to learn its id
+        :param bot_id: the bot user id, None to learn it
+        """
+        self.name = name
+        self.id = bot_id
+
+    def __call__(self, message: dict) -> bool:
+        """
+        :param message: a channel message
+        :return: whether the message was sent by the bot
+        """
+        author = message["author"]
+        if self.id is None:
+            if not (author.get("bot") and author.get("username") == self.name):
+                return False
+            self.id = author["id"]
+            log.info("Bot \"%s\" has id %s", self.name, self.id)
+        return author["id"] == self.id
+
+
+def _decode(body: bytes):
+    """
+    Decodes a response body, with orjson when installed
+    :param body: the response body
+    :return: the decoded body
+    """
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+class _PendingCommand:
+    """
+    A command waiting for the bot reply
+    """
+
+    def __init__(self, message_id: int, sent: float, poll_at: float, interval: float, deadline: float):
+        self.message_id = message_id
+        self.sent = sent
+        self.poll_at = poll_at
+        self.interval = interval
+        self.deadline = deadline
+        self.future = Future()
+
+
+class ChannelReader:
+    """
+    Reads the bot replies for every in-flight command. New channel messages are fetched from a single cursor once per
+    tick and each bot reply is matched to the command that caused it, by message reference or else by ordering (the
+    oldest command sent before the reply).
+    Each command is first checked around when the bot usually replies, then the checks back off towards the slow
+    replies until the command times out.
+    Messages can also be pushed by a listener (see feed), while the listener is live each command only gets a single
+    fallback check shortly before it times out.
+    """
+
+    MIN_POLL_INTERVAL = .1  # seconds
+    MAX_POLL_INTERVAL = 2  # seconds
+    FIRST_POLL_FACTOR = .75  # first poll slightly before the usual reply latency, so the estimate can also go down
+    MAX_PAGE_SIZE = 100  # most messages asked for in a fetch
+    MESSAGES_PER_COMMAND = 2  # messages asked for per pending command (itself and its reply), plus one command worth
+
+    def __init__(self, fetch_messages: Callable[[int, int], List[dict]], is_bot_reply: Callable[[dict], bool],
+                 reply_latency: LatencyEstimator, is_live: Callable[[], bool] = lambda: False):
+        """
+        :param fetch_messages: function returning up to the given number of the channel messages right after the given
+        message id
+        :param is_bot_reply: function telling if a message was sent by the bot
+        :param reply_latency: the estimator of the bot reply latency, fed with the matched replies
+        :param is_live: function telling if a listener is currently pushing the channel messages
+        """
+        self.fetch_messages = fetch_messages
+        self.is_bot_reply = is_bot_reply
+        self.reply_latency = reply_latency
+        self.is_live = is_live
+
+        self._pending: Dict[int, _PendingCommand] = {}
+        self._inbox: List[dict] = []  # bot messages waiting to be matched
+        self._cursor = 0  # newest message seen
+        self._sending = 0  # commands being sent, their replies can not be matched before they are registered
+        self._more = False
+        self._closed = False
+        self._cv = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="channel-reader", daemon=True)
+
+    async def send_async(self, send_command: Callable[[], Awaitable[int]], timeout: float) -> Future:
+        """
+        Sends a command and starts waiting for its reply
+        :param send_command: coroutine function issuing the command and returning its message id, raising if it was not
+        sent
+        :param timeout: seconds to wait for the reply
+        :return: a future resolving to the bot reply (or raising TimeoutError)
+        """
+        sent = time.time()
+
+        with self._cv:
+            self._sending += 1
+
+        message_id = None
+        try:
+            message_id = int(await send_command())
+        finally:
+            command = self._sent(message_id, sent, timeout)
+
+        return command.future
+
+    def feed(self, messages: List[dict]):
+        """
+        Matches messages pushed by a listener
+        :param messages: the new channel messages
+        """
+        with self._cv:
+            self._receive(messages)
+
+    def pending(self) -> int:
+        """
+        :return: the number of commands waiting for a reply
+        """
+        with self._cv:
+            return len(self._pending)
+
+    def close(self):
+        """
+        Stops reading, the commands still waiting time out
+        """
+        with self._cv:
+            self._closed = True
+            for command in self._pending.values():
+                command.future.set_exception(TimeoutError("channel reader closed"))
+            self._pending.clear()
+            self._cv.notify_all()
+
+    def _sent(self, message_id: Union[int, None], sent: float, timeout: float) -> Union[_PendingCommand, None]:
+        with self._cv:
+            self._sending -= 1
+            command = None if message_id is None else self._register(message_id, sent, timeout)
+            self._match()
+            self._cv.notify()
+        return command
+
+    def _register(self, message_id: int, sent: float, timeout: float) -> _PendingCommand:
+        if not self._pending:
+            self._cursor = max(self._cursor, message_id)  # nothing before the command is of interest
+
+        if self.is_live():
+            poll_at = sent + timeout - self.MAX_POLL_INTERVAL
+            interval = self.MAX_POLL_INTERVAL
+        else:
+            p50 = self.reply_latency.percentile(.5)
+            p95 = self.reply_latency.percentile(.95)
+            poll_at = sent + p50 * self.FIRST_POLL_FACTOR
+            interval = min(max((p95 - p50) / 2, self.MIN_POLL_INTERVAL), self.MAX_POLL_INTERVAL)
+
+        command = _PendingCommand(message_id, sent, poll_at, interval, sent + timeout)
+
+        if self._closed:
+            command.future.set_exception(TimeoutError("channel reader closed"))
+            return command
+
+        self._pending[message_id] = command
+
+        if not self._thread.is_alive():
+            self._thread.start()
+
+        return command
+
+    def _run(self):
+        while True:
+            with self._cv:
+                while not self._closed:
+                    if not self._pending:
+                        self._cv.wait()
+                        continue
+
+                    delay = min(min(c.poll_at, c.deadline) for c in self._pending.values()) - time.time()
+                    if delay <= 0 or self._more:
+                        break
+                    self._cv.wait(delay)
+
+                if self._closed:
+                    return
+                after = self._cursor
+                limit = min(self.MESSAGES_PER_COMMAND * (len(self._pending) + 1), self.MAX_PAGE_SIZE)
+
+            try:
+                messages = self.fetch_messages(after, limit)
+            except Exception:
+                log.exception("Error fetching channel messages")
+                messages = None
+
+            with self._cv:
+                self._more = False
+                if messages is not None:
+                    self._more = len(messages) >= limit
+                    self._receive(messages)
+
+                self._back_off(time.time())
+
+    def _receive(self, messages: List[dict]):
+        for message in sorted(messages, key=lambda m: int(m["id"])):
+            message_id = int(message["id"])
+            if message_id <= self._cursor:
+                continue  # already seen (pushed and fetched)
+
+            self._cursor = message_id
+            if self.is_bot_reply(message):
+                self._inbox.append(message)
+
+        self._match()
+
+    def _match(self):
+        if self._sending:
+            return  # the reply could be to a command that is not registered yet
+
+        for message in self._inbox:
+            message_id = int(message["id"])
+            reference = (message.get("message_reference") or {}).get("message_id")
+            if reference is not None:
+                command = self._pending.pop(int(reference), None)  # replies to other users commands are ignored
+            else:
+                earlier = [c for c in self._pending if c < message_id]
+                command = self._pending.pop(min(earlier)) if earlier else None
+
+            if command:
+                self._record_reply_latency(command, message)
+                command.future.set_result(message)
+
+        self._inbox.clear()
+
+    def _back_off(self, now: float):
+        for message_id, command in list(self._pending.items()):
+            if command.deadline <= now:
+                del self._pending[message_id]
+                command.future.set_exception(TimeoutError(f"no reply to message {message_id}"))
+            elif command.poll_at <= now + self.MIN_POLL_INTERVAL:  # polls due shortly are covered by this one
+                command.poll_at = now + command.interval
+                command.interval = min(command.interval * 2, self.MAX_POLL_INTERVAL)
+
+    def _record_reply_latency(self, command: _PendingCommand, message: dict):
+        """
+        Records how long the bot took to reply, using the message ids creation times when possible since the observed
+        time is skewed by the polling interval
+        """
+        observed = time.time() - command.sent
+        latency = _snowflake_time(message["id"]) - _snowflake_time(command.message_id)
+        self.reply_latency.add(latency if 0 <= latency <= observed else observed)
+
+
+class AsyncWateringCan:
     DISCORD_API_VERSION = 8
     ENDPOINT = f"https://discord.com/api/v{DISCORD_API_VERSION}"
     USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) " \
                  "Chrome/87.0.4280.141 Safari/537.36 "
+    MAX_RATE_LIMIT_RETRIES = 3
 
-    def __init__(self, user_token, channel):
+    def __init__(self, user_token, channel, pool_size: int = 4, timeout: float = 10, endpoint: str = ENDPOINT,
+                 feedback_timeout: float = 10, receive_mode: str = "poll",
+                 gateway_url: str = gateway.GatewayListener.GATEWAY_URL, bot_id: str = None,
+                 breaker: CircuitBreaker = None, rate_limiter: RateLimiter = None):
         """
-        API for user interactions with the FlowerBot
+        asyncio API for user interactions with the FlowerBot, a single instance is meant to be shared by every command
+        running on its event loop
         :param user_token: the token of the user interacting with the bot
         :param channel: the channel the bot is on
+        :param pool_size: maximum number of open connections
+        :param timeout: seconds to wait for the discord api to answer a request
+        :param endpoint: the discord api endpoint
+        :param feedback_timeout: seconds to wait for the bot to reply to a command
+        :param receive_mode: how the bot replies are received, "poll" reads the channel messages while commands wait
+        for their replies, "gateway" listens for them on a websocket connection (polling while it is down)
+        :param gateway_url: the discord gateway url, used on gateway receive mode
+        :param bot_id: the user id of the bot, None to learn it from its first reply
+        :param breaker: pauses the commands after a burst of failures
+        :param rate_limiter: keeps the requests within the discord rate limits
         """
         self.user_token = user_token
         self.channel = channel
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.endpoint = endpoint
+        self.feedback_timeout = feedback_timeout
+        self.reply_latency = LatencyEstimator()
+        self.bot = BotAuthor(bot_id=bot_id)
+        self.reader = ChannelReader(self._fetch_messages, self.bot, self.reply_latency)
+
+        self.gateway = None
+        if receive_mode == "gateway":
+            if gateway.websocket is None:
+                log.warning("websocket-client is not installed, polling for the bot replies")
+            else:
+                self.gateway = gateway.GatewayListener(user_token, channel, lambda m: self.reader.feed([m]),
+                                                       gateway_url)
+                self.reader.is_live = self.gateway.is_connected
+                self.gateway.start()
+        elif receive_mode != "poll":
+            raise ValueError(f"Unknown receive mode: {receive_mode}")
+
+        self.rate_limiter = rate_limiter or RateLimiter()
+        _rate_limit_queue.read = self.rate_limiter.queue_depth
+        self.breaker = breaker or CircuitBreaker()
+        self.session: Union[aiohttp.ClientSession, None] = None  # opened on the event loop by the first request
+        self._loop: Union[asyncio.AbstractEventLoop, None] = None
+
+    async def close(self):
+        """
+        Stops reading the channel and closes the pooled connections
+        """
+        if self.gateway:
+            self.gateway.close()
+        self.reader.close()
+        if self.session is not None:
+            await self.session.close()
+
+    async def __aenter__(self):
+        return self
 
-    def water_plant(self, plant_name) -> \
-            Union[Tuple[bool, Union[time.struct_time, time.struct_time]], Tuple[bool, None]]:
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def water_plant(self, plant_name) -> Union[Tuple[bool, int], Tuple[bool, None]]:
         """
         Waters a plant
         :param plant_name: the name of the plant to water
         :return: tuple with first argument indicating if the command was successful, if unsuccessful second argument
-        indicates the command remaining cooldown
+        indicates the command remaining cooldown in seconds
+        :raises CommandError: if the command failed, like every command
         """
-        return self._issue_command_get_feedback(f"p.water {plant_name}", _parse_watering_message)
+        return await self._issue_command_get_feedback(f"p.water {plant_name}", _parse_watering_message)
 
-    def get_exp(self) -> Union[int, None]:
+    async def get_exp(self) -> Union[int, None]:
         """
         :return: the current exp
         """
-        return self._issue_command_get_feedback("p.exp", _parse_exp_message)
+        return await self._issue_command_get_feedback("p.exp", _parse_exp_message)
 
-    def get_shop(self) -> Union[Dict[str, int], None]:
+    async def get_shop(self) -> Union[Dict[str, int], None]:
         """
         :return: dictionary representing the available plants on the shop and their prices
         """
-        return self._issue_command_get_feedback("p.shop", _parse_shop_message)
+        return await self._issue_command_get_feedback("p.shop", _parse_shop_message)
 
-    def get_plants(self) -> Union[Tuple[Plant], None]:
+    async def get_plants(self) -> Union[Tuple[Plant], None]:
         """
         :return: a list of the user plants
         """
-        return self._issue_command_get_feedback("p.plants", _parse_plants_message)
-
-    def _issue_command_get_feedback(self, command: str, feedback_parser: Callable[[dict], None]) -> Union:
-
-        message_id = self._issue_command(command)
+        return await self._issue_command_get_feedback("p.plants", _parse_plants_message)
 
-        time.sleep(1)  # wait for bot feedback
-
-        return self._get_feedback(message_id, feedback_parser)
-
-    def _issue_command(self, command: str) -> int:
+    async def _issue_command_get_feedback(self, command: str, feedback_parser: Callable[[dict], None]) -> Union:
+        """
+        Issues a command and waits for the bot feedback until it shows up or the feedback timeout runs out
+        :param command: the command to issue
+        :param feedback_parser: the parser for the bot feedback message
+        :return: the parsed feedback
+        :raises CircuitOpenError: if commands are paused
+        :raises SendError: if the command could not be sent
+        :raises NoReplyError: if the bot did not reply in time
+        :raises BadReplyError: if the bot reply could not be parsed
+        """
+        command_type = command.split(" ", 1)[0]
+
+        if not self.breaker.allow():
+            _commands_total.inc(command_type, "paused")
+            raise CircuitOpenError(command, self.breaker.retry_at)
+
+        try:
+            start = time.perf_counter()
+            message = await self._send_and_wait(command)
+            _reply_wait_seconds.observe(time.perf_counter() - start, command_type)
+            feedback = self._parse(command, message, feedback_parser)
+        except CommandError as e:
+            _commands_total.inc(command_type, "error" if isinstance(e, SendError) else
+                                "bad_reply" if isinstance(e, BadReplyError) else "no_reply")
+            self.breaker.record_failure(e.reason)
+            raise
+        self.breaker.record_success()
+
+        _commands_total.inc(command_type, "reply")
+        return feedback
+
+    @staticmethod
+    def _parse(command: str, message: dict, feedback_parser: Callable[[dict], None]):
+        """
+        :return: the parsed feedback
+        :raises BadReplyError: if the parser failed on the message
+        """
+        try:
+            with _parse_seconds.time(feedback_parser.__name__):
+                return feedback_parser(message)
+        except (LookupError, TypeError, ValueError, AttributeError) as e:
+            log.error("Could not parse the reply to \"%s\": %r\n%s", command, e, message)
+            raise BadReplyError(command, f"unexpected reply ({type(e).__name__}: {e})") from e
+
+    async def _send_and_wait(self, command: str) -> dict:
+        """
+        :param command: the command to issue
+        :return: the bot reply
+        :raises SendError: if the command could not be sent
+        :raises NoReplyError: if the bot did not reply in time
+        """
+        # the rate limit slot is taken first, replies are not matched while a command is being sent
+        await self.rate_limiter.acquire_async(f"POST /channels/{self.channel}/messages")
+        try:
+            feedback = await self.reader.send_async(lambda: self._issue_command(command, True), self.feedback_timeout)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise SendError(command, f"{type(e).__name__}: {e}") from e
+
+        # the reader times the command out, waiting is bounded in case the reader stopped
+        reply = asyncio.wrap_future(feedback)
+        await asyncio.wait({reply}, timeout=self.feedback_timeout)
+        if not reply.done():
+            reply.add_done_callback(lambda f: f.exception())  # the reader times it out later, nothing to report
+        if not reply.done() or isinstance(reply.exception(), TimeoutError):
+            log.warning("No feedback for \"%s\" after %s seconds", command, self.feedback_timeout)
+            raise NoReplyError(command, f"no reply after {self.feedback_timeout} seconds")
+        return reply.result()
+
+    async def _issue_command(self, command: str, acquired: bool = False) -> int:
         """
         Issues a command
         :param command: the command to issue
+        :param acquired: whether the rate limit slot for sending was already taken
         :return: the message id related to the issued command
+        :raises SendError: if the command was not accepted, or its message id not returned
         """
 
         message_content = {
@@ -221,32 +731,78 @@ class WateringCan:
         }
 
         # sends water plant message
-        send_r = requests.post(f"{self.ENDPOINT}/channels/{self.channel}/messages",
-                               headers=self._build_discord_header_data(), json=message_content)
-
-        if send_r.status_code >= 299:
-            log.critical(f"Error sending command: status code={send_r.status_code}")
-
-        if "id" not in send_r.json():
-            log.error(f"Message ID not found\n{send_r.json()}")
-            return -1
-
-        return send_r.json()["id"]  # command message id
-
-    def _get_feedback(self, message_id: int, feedback_parser: Callable[[dict], None]) -> Union[tuple, dict, None]:
-
-        # get messages after the message (should include bot feedback message)
-        get_messages_r = requests.get(f"{self.ENDPOINT}/channels/{self.channel}/messages",
-                                      headers=self._build_discord_header_data(), params={"after": message_id})
+        with _command_send_seconds.time(command.split(" ", 1)[0]):
+            send_r, data = await self._request("POST", f"/channels/{self.channel}/messages", acquired,
+                                               json=message_content)
+
+        if send_r.status >= 299:
+            log.error("Error sending command: status code=%s", send_r.status)
+            raise SendError(command, f"status code {send_r.status}", send_r.status)
+
+        try:
+            return int(_decode(data)["id"])  # command message id
+        except (LookupError, TypeError, ValueError) as e:  # not json, not an object or not a numeric id
+            log.error("Message ID not found\n%s", data[:1000])
+            reason = f"no message id in the response ({type(e).__name__}: {e})"
+            raise SendError(command, reason, send_r.status) from e
+
+    async def _get_messages(self, message_id: int, limit: int = 50) -> List[dict]:
+        """
+        Gets the channel messages sent right after a message
+        :param message_id: the message id to read after
+        :param limit: the most messages to get (up to 100)
+        :return: the messages
+        :raises aiohttp.ClientResponseError: if the messages could not be read
+        """
+        with _messages_read_seconds.time():
+            get_messages_r, data = await self._request("GET", f"/channels/{self.channel}/messages",
+                                                       params={"after": message_id, "limit": limit})
+        get_messages_r.raise_for_status()
 
-        messages = get_messages_r.json()
+        return _decode(data)
 
-        # iterate through messages
-        for message in messages:
-            if message["author"]["username"] == "Flower":  # bot feedback message
-                return feedback_parser(message)  # pass the message to the feedback parser
+    def _fetch_messages(self, message_id: int, limit: int) -> List[dict]:
+        """
+        Gets the channel messages from another thread (the channel reader), through the event loop
+        """
+        with PROFILER.section("reader:fetch"):  # shared by the commands waiting for a reply
+            return asyncio.run_coroutine_threadsafe(PROFILER.carry(self._get_messages(message_id, limit)),
+                                                    self._loop).result()
 
-        return None
+    async def _request(self, method: str, path: str, acquired: bool = False,
+                       **kwargs) -> Tuple[aiohttp.ClientResponse, bytes]:
+        """
+        Sends a request to the discord api once its rate limit allows it, retrying when rate limited anyway
+        :param method: the http method
+        :param path: the path of the endpoint
+        :param acquired: whether the rate limit slot for the first try was already taken
+        :param kwargs: arguments passed on to the request
+        :return: the response and its body
+        """
+        if self.session is None:
+            # connections are kept alive and reused, headers are only built once
+            self._loop = asyncio.get_running_loop()
+            self.session = aiohttp.ClientSession(headers=self._build_discord_header_data(),
+                                                 timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                                 connector=aiohttp.TCPConnector(limit=self.pool_size))
+
+        route = f"{method} {path}"
+
+        for attempt in range(self.MAX_RATE_LIMIT_RETRIES):
+            if attempt or not acquired:
+                await self.rate_limiter.acquire_async(route)
+            try:
+                async with self.session.request(method, f"{self.endpoint}{path}", **kwargs) as response:
+                    data = await response.read()
+            except BaseException:
+                self.rate_limiter.release(route)  # no response to learn the limits from
+                raise
+            self.rate_limiter.update(route, response.status, response.headers)
+
+            if response.status != 429:
+                return response, data
+
+        return response, data
 
     def _build_discord_header_data(self):
         """
@@ -259,3 +815,73 @@ class WateringCan:
             "origin": "https://discord.com"
 
         }
+
+
+class WateringCan:
+    """
+    Blocking API for user interactions with the FlowerBot, running an AsyncWateringCan on its own event loop thread. A
+    single instance is meant to be shared by all workers.
+    """
+    ENDPOINT = AsyncWateringCan.ENDPOINT
+
+    def __init__(self, *args, **kwargs):
+        """
+        Takes the same arguments as AsyncWateringCan
+        """
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="watering-can", daemon=True)
+        self._thread.start()
+        self.can = AsyncWateringCan(*args, **kwargs)
+
+    def close(self):
+        """
+        Stops reading the channel, closes the pooled connections and stops the event loop
+        """
+        self._run(self.can.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def water_plant(self, plant_name) -> Union[Tuple[bool, int], Tuple[bool, None]]:
+        """
+        Waters a plant
+        :param plant_name: the name of the plant to water
+        :return: tuple with first argument indicating if the command was successful, if unsuccessful second argument
+        indicates the command remaining cooldown in seconds
+        :raises CommandError: if the command failed, like every command
+        """
+        return self._command("p.water", self.can.water_plant(plant_name))
+
+    def get_exp(self) -> Union[int, None]:
+        """
+        :return: the current exp
+        """
+        return self._command("p.exp", self.can.get_exp())
+
+    def get_shop(self) -> Union[Dict[str, int], None]:
+        """
+        :return: dictionary representing the available plants on the shop and their prices
+        """
+        return self._command("p.shop", self.can.get_shop())
+
+    def get_plants(self) -> Union[Tuple[Plant], None]:
+        """
+        :return: a list of the user plants
+        """
+        return self._command("p.plants", self.can.get_plants())
+
+    def _command(self, command_type: str, coroutine: Coroutine):
+        with PROFILER.section(f"command:{command_type}"):
+            return self._run(PROFILER.carry(coroutine))  # the command runs on the event loop thread
+
+    def _run(self, coroutine: Coroutine):
+        """
+        Runs a coroutine on the event loop and waits for its result
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
@@ -0,0 +1,122 @@
+"""
+Circuit breaker shared by every bot command: a burst of failed commands opens it, pausing the commands (and the
+scheduler dispatching them) instead of having every worker keep hitting a failing api. Once the pause is over a single
+probe command is let through, closing the breaker if it succeeds and reopening it for longer if it fails.
+"""
+from collections import deque
+from typing import Callable
+
+from metrics import Counter
+
+import random
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+_transitions = Counter("flower_breaker_transitions_total", "Circuit breaker state changes", ("state",))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker(object):
+    """
+    Counts the failures in a sliding window, opening once they reach a threshold. Open pauses grow exponentially while
+    the probes fail and are jittered, so processes sharing an api do not probe in lockstep.
+    """
+
+    def __init__(self, failure_threshold: int = 5, window: float = 30, open_time: float = 30,
+                 max_open_time: float = 600, jitter: float = .2, clock: Callable[[], float] = time.time):
+        """
+        :param failure_threshold: failures within the window that open the breaker
+        :param window: seconds failures are counted over
+        :param open_time: seconds the breaker first stays open for
+        :param max_open_time: the longest the breaker stays open for
+        :param jitter: fraction of the open time randomly added to it
+        :param clock: function returning the current time in seconds
+        """
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.open_time = open_time
+        self.max_open_time = max_open_time
+        self.jitter = jitter
+        self.clock = clock
+
+        self.state = CLOSED
+        self.retry_at = 0  # the time a probe can be sent at, while open
+        self.last_error = None  # what the last failure was, for display
+        self.opened = 0  # times the breaker opened
+
+        self._failures = deque()  # failure times within the window
+        self._pause = open_time  # the next open time, before jitter
+        self._probe_at = None  # the time the probe in flight was let through at
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Checks whether a command can be sent, letting a single probe through once the breaker was open long enough
+        :return: whether the command can be sent
+        """
+        with self._lock:
+            now = self.clock()
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and now >= self.retry_at:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and (self._probe_at is None or now - self._probe_at > self.max_open_time):
+                self._probe_at = now  # a probe never reported (e.g. cancelled) is replaced after a while
+                return True
+            return False
+
+    def wait_time(self) -> float:
+        """
+        :return: seconds until commands can be sent again, 0 if they can be sent now (or a probe can)
+        """
+        with self._lock:
+            if self.state == OPEN:
+                return max(self.retry_at - self.clock(), 0)
+            if self.state == HALF_OPEN and self._probe_at is not None:
+                return 1  # checked again once the probe reports, or in a second
+            return 0
+
+    def record_success(self):
+        with self._lock:
+            self._failures.clear()
+            self._pause = self.open_time
+            self._probe_at = None
+            if self.state != CLOSED:
+                log.warning("Commands are going through again, resuming")
+                self._set_state(CLOSED)
+
+    def record_failure(self, error: str = None):
+        """
+        :param error: what failed, for display
+        """
+        with self._lock:
+            now = self.clock()
+            self.last_error = error
+            self._failures.append(now)
+            while self._failures and self._failures[0] <= now - self.window:
+                self._failures.popleft()
+
+            if self.state == HALF_OPEN:
+                self._probe_at = None
+                self._open(now)
+            elif self.state == CLOSED and len(self._failures) >= self.failure_threshold:
+                self._open(now)
+
+    def _open(self, now: float):
+        pause = self._pause * (1 + random.uniform(0, self.jitter))
+        self.retry_at = now + pause
+        self._pause = min(self._pause * 2, self.max_open_time)
+        self.opened += 1
+        log.warning("%s failed commands, pausing commands for %.0f seconds (last error: %s)",
+                    len(self._failures), pause, self.last_error)
+        self._set_state(OPEN)
+
+    def _set_state(self, state: str):
+        self.state = state
+        _transitions.inc(state)
@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Callable, Dict, Tuple, Union
+
+from botAPI import CommandError
+
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class _Entry:
+    """
+    The last known value of a key and its refresh in flight
+    """
+
+    def __init__(self, loader: Callable[[], Any], ttl: float):
+        self.loader = loader
+        self.ttl = ttl
+        self.value = None
+        self.fetched_at = None
+        self.retry_at = 0  # failed loads are not retried before this time
+        self.refreshing: Union[Future, None] = None
+
+
+class StatsCache:
+    """
+    Caches the results of slow queries (like the bot exp, shop and plants commands) per key. Reads never wait: they
+    get the last known value, and stale keys are refreshed in the background with a single refresh in flight per key.
+    """
+
+    RETRY_DELAY = 30  # seconds to wait before loading a key again after a failure (at most its ttl)
+
+    def __init__(self, loaders: Dict[str, Tuple[Callable[[], Any], float]], max_workers: int = 2):
+        """
+        :param loaders: the function loading each key and the seconds its value stays fresh, as {key: (loader, ttl)}
+        :param max_workers: maximum number of refreshes running at the same time
+        """
+        self._entries = {key: _Entry(loader, ttl) for key, (loader, ttl) in loaders.items()}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="stats-cache")
+
+    def get(self, key: str) -> Tuple[Any, Union[float, None]]:
+        """
+        Gets the last known value of a key, refreshing it in the background if stale
+        :param key: the key
+        :return: the value (None if never loaded) and its age in seconds (None if never loaded)
+        """
+        with self._lock:
+            entry = self._entries[key]
+            age = None if entry.fetched_at is None else time.time() - entry.fetched_at
+            if (age is None or age > entry.ttl) and time.time() >= entry.retry_at:
+                self._refresh(key, entry)
+            return entry.value, age
+
+    def refresh(self, key: str) -> Future:
+        """
+        Refreshes a key in the background, unless a refresh is already in flight
+        :param key: the key
+        :return: the refresh in flight, resolving to the loaded value
+        """
+        with self._lock:
+            return self._refresh(key, self._entries[key])
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+    def _refresh(self, key: str, entry: _Entry) -> Future:
+        if entry.refreshing is None:
+            entry.refreshing = self._pool.submit(self._load, key, entry)
+        return entry.refreshing
+
+    def _load(self, key: str, entry: _Entry):
+        value = None
+        try:
+            value = entry.loader()
+        except CommandError as e:
+            log.warning("Could not load \"%s\": %s", key, e)
+        except Exception:
+            log.exception("Error loading \"%s\"", key)
+
+        with self._lock:
+            if value is not None:
+                entry.value = value
+                entry.fetched_at = time.time()
+            else:
+                entry.retry_at = time.time() + min(self.RETRY_DELAY, entry.ttl)
+            entry.refreshing = None
+
+        return value
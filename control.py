@@ -0,0 +1,185 @@
+"""
+Local control of a running farm over a UNIX domain socket. Each request is a line of JSON, {"command": <name>,
+"args": {...}}, answered by a line of JSON, {"result": ...} or {"error": <message>}. Used by the terminal UI to attach
+to a headless farm, or by anything else speaking line delimited JSON (e.g. `socat - UNIX-CONNECT:flower.sock`).
+"""
+from typing import Any, Callable, Dict
+
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class ControlError(Exception):
+    """
+    A control request that failed, on the server or reaching it
+    """
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "_Server"
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            self.wfile.write(json.dumps(self.server.control.handle(line)).encode() + b"\n")
+            self.wfile.flush()
+
+
+if hasattr(socket, "AF_UNIX"):  # not on every platform, like Windows
+    class _Server(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+        control: "ControlServer" = None
+
+
+def _check_supported():
+    """
+    :raises OSError: if UNIX domain sockets are not supported on this platform
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        raise OSError("UNIX domain sockets are not supported on this platform")
+
+
+class ControlServer(object):
+    """
+    Serves the farm commands on a UNIX domain socket, only the user running the farm can connect to it
+    """
+
+    def __init__(self, path: str, commands: Dict[str, Callable[..., Any]]):
+        """
+        :param path: the socket file path
+        :param commands: command name -> function running it, called with the request arguments as keyword arguments
+        and returning a JSON serializable result
+        """
+        self.path = path
+        self.commands = commands
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """
+        Starts serving
+        :raises OSError: if the socket could not be bound, like when another farm is serving on it
+        """
+        _check_supported()
+        self._remove_stale()
+        self._server = _Server(self.path, _Handler)
+        self._server.control = self
+        os.chmod(self.path, stat.S_IRUSR | stat.S_IWUSR)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="control", daemon=True)
+        self._thread.start()
+        log.info("Control socket listening on %s", self.path)
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def handle(self, line: bytes) -> dict:
+        """
+        Runs a request
+        :param line: the JSON request
+        :return: the response
+        """
+        try:
+            request = json.loads(line)
+            command = self.commands.get(request.get("command"))
+            if command is None:
+                return {"error": f"unknown command {request.get('command')!r}, "
+                                 f"available: {', '.join(sorted(self.commands))}"}
+            return {"result": command(**request.get("args", {}))}
+        except Exception as e:
+            log.warning("Control request %r failed: %s", line, e)
+            return {"error": f"{type(e).__name__}: {e}"}
+
+    def _remove_stale(self):
+        """
+        Removes a socket file left behind by a farm that did not shut down cleanly, not one still being served
+        """
+        if not os.path.exists(self.path):
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.unlink(self.path)
+                return
+        raise OSError(f"A farm is already serving on {self.path}")
+
+
+class ControlClient(object):
+    """
+    Sends commands to a running farm, over a single connection reopened when lost
+    """
+
+    def __init__(self, path: str, timeout: float = 30):
+        """
+        :param path: the socket file path
+        :param timeout: seconds to wait for a response, commands like refreshing the plants wait for the bot
+        """
+        self.path = path
+        self.timeout = timeout
+        self._socket = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def call(self, command: str, **args) -> Any:
+        """
+        :param command: the command name
+        :param args: the command arguments
+        :return: the command result
+        :raises ControlError: if the command failed or the farm could not be reached
+        """
+        request = json.dumps({"command": command, "args": args}).encode() + b"\n"
+        with self._lock:
+            for attempt in range(2):  # the connection may have been closed since the last call
+                try:
+                    if self._socket is None:
+                        self._connect()
+                    self._socket.sendall(request)
+                    line = self._file.readline()
+                    if not line:
+                        raise ConnectionError("connection closed by the farm")
+                    break
+                except socket.timeout as e:  # not retried, the farm may still be running the command
+                    self.close()
+                    raise ControlError(f"No response from the farm after {self.timeout} seconds") from e
+                except OSError as e:
+                    self.close()
+                    if attempt:
+                        raise ControlError(f"Could not reach the farm on {self.path}: {e}") from e
+
+        response = json.loads(line)
+        if "error" in response:
+            raise ControlError(response["error"])
+        return response["result"]
+
+    def close(self):
+        if self._socket is not None:
+            self._file.close()
+            self._socket.close()
+            self._socket = self._file = None
+
+    def _connect(self):
+        _check_supported()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(self.timeout)
+        try:
+            self._socket.connect(self.path)
+        except OSError:
+            self._socket.close()
+            self._socket = None
+            raise
+        self._file = self._socket.makefile("rb")
@@ -0,0 +1,101 @@
+"""
+Builders for the messages the Flower bot sends, in the shapes the watering can parsers expect.
+Used as the benchmark corpus and by the local stand-ins.
+"""
+from typing import Dict, List, Tuple
+
+BOT_NAME = "Flower"
+BOT_ID = "2"  # the simulated bot user id
+
+
+def format_duration(seconds: int) -> str:
+    """
+    :param seconds: the duration
+    :return: the duration as written on the bot embeds, e.g. "2 hours 5 minutes"
+    """
+    parts = []
+    for unit, size in (("day", 86400), ("hour", 3600), ("minute", 60), ("second", 1)):
+        value, seconds = divmod(seconds, size)
+        if value:
+            parts.append(f"{value} {unit}{'s' if value > 1 else ''}")
+    return " ".join(parts) or "0 seconds"
+
+
+def format_wait(seconds: int) -> str:
+    """
+    :param seconds: the cooldown
+    :return: the cooldown as written on the bot wait messages, e.g. "5m 3s"
+    """
+    parts = []
+    for unit, size in (("h", 3600), ("m", 60), ("s", 1)):
+        value, seconds = divmod(seconds, size)
+        if value:
+            parts.append(f"{value}{unit}")
+    return " ".join(parts) or "0s"
+
+
+def _message(content: str = "", embeds: List[dict] = None, message_id: int = 0) -> dict:
+    return {
+        "id": str(message_id),
+        "author": {"username": BOT_NAME, "id": BOT_ID, "bot": True},
+        "content": content,
+        "embeds": embeds or []
+    }
+
+
+def water_success(plant_name: str, message_id: int = 0) -> dict:
+    return _message(embeds=[{"title": "Watered!", "description": f"You watered **{plant_name}**, it feels great!"}],
+                    message_id=message_id)
+
+
+def water_cooldown(seconds: int, message_id: int = 0) -> dict:
+    return _message(f"You need to wait another {format_wait(seconds)} to water this plant again.",
+                    message_id=message_id)
+
+
+def no_plant(plant_name: str, message_id: int = 0) -> dict:
+    return _message(f"You have no plant named {plant_name}.", message_id=message_id)
+
+
+def exp(value: int, message_id: int = 0) -> dict:
+    return _message(embeds=[{"title": "Experience", "description": f"You currently have **{value:,}** exp."}],
+                    message_id=message_id)
+
+
+def shop(plants: Dict[str, int], items: Dict[str, int], message_id: int = 0) -> dict:
+    plant_lines = "\n".join(f"`{name} - {price}`" for name, price in plants.items())
+    item_lines = "\n".join(f"~~`{name} - {price}`~~" for name, price in items.items())
+    return _message(embeds=[{"title": "Shop", "fields": [
+        {"name": "Plants", "value": f"{plant_lines}\nBuy a plant with p.buy <plant>"},
+        {"name": "Items", "value": item_lines}
+    ]}], message_id=message_id)
+
+
+def plants(u_plants: List[Tuple[str, str, int, int, int, int]], message_id: int = 0) -> dict:
+    """
+    :param u_plants: the plants, as (name, type, level, max level, seconds until death, seconds alive)
+    """
+    return _message(embeds=[{"title": "Your plants", "fields": [
+        {"name": name,
+         "value": f"**{plant_type}** plant, level {level}/{max_level}.\n"
+                  f"Dies in **{format_duration(death)}** if not watered.\n"
+                  f"Alive for **{format_duration(alive)}**."}
+        for name, plant_type, level, max_level, death, alive in u_plants
+    ]}], message_id=message_id)
+
+
+def corpus() -> Dict[str, List[dict]]:
+    """
+    Synthetic, built with the builders above: the durations and numbers cover the formats the parsers accept, but are
+    not recorded from the bot
+    :return: sample messages of every shape, by message type
+    """
+    return {
+        "water": [water_success(f"plant{i}") for i in range(5)],
+        "wait": [water_cooldown(s) for s in (3, 59, 60, 61, 754, 900, 3599, 3600, 3723)],
+        "exp": [exp(v) for v in (0, 7, 1234, 98765, 12345678)],
+        "shop": [shop({"Sunflower": 100, "Cactus": 250, "Rose": 1500}, {"Fertilizer": 50, "Sprinkler": 3000})],
+        "plants": [plants([(f"plant{i}", "Sunflower", i % 10, 10, 3600 * (i % 48) + 61, 86400 * i + 3725)
+                           for i in range(n)]) for n in (1, 5, 25)],
+        "time": [format_duration(s) for s in (1, 60, 61, 3600, 3725, 86400, 90061, 1209600)]
+    }
@@ -0,0 +1,183 @@
+from typing import Callable, Union
+
+import json
+import random
+import threading
+import logging
+
+try:
+    import websocket  # websocket-client
+except ImportError:
+    websocket = None
+
+log = logging.getLogger(__name__)
+
+
+class GatewayListener:
+    """
+    Keeps a discord gateway (websocket) connection open and passes the messages created on a channel to a callback.
+    The connection is kept alive with heartbeats, and is resumed (or identified again) when it drops.
+    """
+
+    GATEWAY_URL = "wss://gateway.discord.gg"
+    MAX_RECONNECT_DELAY = 60  # seconds
+
+    # opcodes
+    DISPATCH = 0
+    HEARTBEAT = 1
+    IDENTIFY = 2
+    RESUME = 6
+    RECONNECT = 7
+    INVALID_SESSION = 9
+    HELLO = 10
+    HEARTBEAT_ACK = 11
+
+    INTENTS = (1 << 9) | (1 << 12) | (1 << 15)  # guild messages, direct messages and message content
+
+    def __init__(self, token: str, channel, on_message: Callable[[dict], None], url: str = GATEWAY_URL,
+                 api_version: int = 8):
+        """
+        :param token: the token of the user
+        :param channel: the channel to listen on
+        :param on_message: callback receiving every message created on the channel
+        :param url: the gateway url
+        :param api_version: the gateway version
+        """
+        if websocket is None:
+            raise RuntimeError("websocket-client is required to listen on the gateway")
+
+        self.token = token
+        self.channel = str(channel)
+        self.on_message = on_message
+        self.url = url
+        self.api_version = api_version
+
+        self._connected = threading.Event()
+        self._closed = threading.Event()
+        self._ws: Union[websocket.WebSocket, None] = None
+        self._sequence = None
+        self._session_id = None
+        self._resume_url = None
+        self._acked = True
+        self._thread = threading.Thread(target=self._run, name="gateway", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._closed.set()
+        if self._ws:
+            self._ws.close()
+
+    def is_connected(self) -> bool:
+        """
+        :return: whether the connection is up and the messages are being received
+        """
+        return self._connected.is_set()
+
+    def _run(self):
+        delay = 1
+        while not self._closed.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                if not self._closed.is_set():
+                    log.warning("Gateway connection lost: %s", e)
+
+            if self._connected.is_set():
+                delay = 1
+            self._connected.clear()
+
+            if not self._closed.wait(delay * random.uniform(1, 1.5)):
+                delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+
+    def _listen(self):
+        """
+        Connects and handles the gateway events until the connection closes or a reconnect is requested
+        """
+        resume = self._session_id is not None and self._sequence is not None
+        url = self._resume_url if resume and self._resume_url else self.url
+
+        self._ws = ws = websocket.create_connection(f"{url}/?v={self.api_version}&encoding=json",
+                                                   enable_multithread=True)
+        stop_heartbeat = threading.Event()
+        try:
+            hello = self._receive(ws)
+            if hello is None or hello["op"] != self.HELLO:
+                raise ConnectionError(f"Expected hello, got {hello}")
+
+            threading.Thread(target=self._heartbeat, name="gateway-heartbeat", daemon=True,
+                             args=(ws, hello["d"]["heartbeat_interval"] / 1000, stop_heartbeat)).start()
+
+            if resume:
+                self._send(ws, self.RESUME, {"token": self.token, "session_id": self._session_id,
+                                             "seq": self._sequence})
+            else:
+                self._send(ws, self.IDENTIFY, {"token": self.token, "intents": self.INTENTS,
+                                               "properties": {"os": "linux", "browser": "FlowerBotFarmer",
+                                                              "device": "FlowerBotFarmer"}})
+
+            while not self._closed.is_set():
+                payload = self._receive(ws)
+                if payload is None:
+                    return
+
+                op = payload["op"]
+                if op == self.DISPATCH:
+                    self._sequence = payload["s"]
+                    self._dispatch(payload["t"], payload["d"])
+                elif op == self.HEARTBEAT:
+                    self._send(ws, self.HEARTBEAT, self._sequence)
+                elif op == self.HEARTBEAT_ACK:
+                    self._acked = True
+                elif op == self.RECONNECT:
+                    log.info("Gateway requested a reconnect")
+                    return
+                elif op == self.INVALID_SESSION:
+                    if not payload["d"]:  # not resumable
+                        self._session_id = self._sequence = None
+                    log.info("Gateway session invalidated")
+                    return  # nothing is received until the session is identified again, after the reconnect delay
+        finally:
+            stop_heartbeat.set()
+            ws.close()
+
+    def _heartbeat(self, ws, interval: float, stop: threading.Event):
+        self._acked = True
+        wait = interval * random.random()  # first heartbeat is jittered
+
+        while not stop.wait(wait):
+            if not self._acked:  # zombie connection, closing it makes the listener reconnect and resume
+                log.warning("Gateway heartbeat not acknowledged, reconnecting")
+                ws.close()
+                return
+
+            self._acked = False
+            try:
+                self._send(ws, self.HEARTBEAT, self._sequence)
+            except Exception as e:
+                log.warning("Error sending heartbeat: %s", e)
+                return
+            wait = interval
+
+    def _dispatch(self, event: str, data: dict):
+        if event == "READY":
+            self._session_id = data["session_id"]
+            self._resume_url = data.get("resume_gateway_url")
+            self._connected.set()
+        elif event == "RESUMED":
+            self._connected.set()
+        elif event == "MESSAGE_CREATE" and data.get("channel_id") == self.channel:
+            try:
+                self.on_message(data)
+            except Exception:
+                log.exception("Error handling message %s", data.get("id"))
+
+    @staticmethod
+    def _receive(ws) -> Union[dict, None]:
+        data = ws.recv()
+        return json.loads(data) if data else None
+
+    @staticmethod
+    def _send(ws, op: int, data):
+        ws.send(json.dumps({"op": op, "d": data}))
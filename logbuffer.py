@@ -0,0 +1,37 @@
+from collections import deque
+from typing import List
+
+import logging
+
+
+class RingBufferHandler(logging.Handler):
+    """
+    Keeps the latest log records in memory, they are only formatted when read (e.g. by the log view)
+    """
+
+    def __init__(self, capacity: int = 1000, level: int = logging.NOTSET):
+        """
+        :param capacity: how many of the latest records are kept
+        :param level: the minimum level of the kept records
+        """
+        super(RingBufferHandler, self).__init__(level)
+        self.records = deque(maxlen=capacity)
+        self.emitted = 0  # records kept since the start, including the ones pushed out
+
+    def emit(self, record: logging.LogRecord):
+        if record.exc_info:
+            # the traceback is rendered now, so its frames are not kept alive
+            record.exc_text = (self.formatter or logging.Formatter()).formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+        self.emitted += 1
+
+    def snapshot(self) -> List[logging.LogRecord]:
+        """
+        :return: the kept records, oldest first
+        """
+        self.acquire()
+        try:
+            return list(self.records)
+        finally:
+            self.release()
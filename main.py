@@ -1,10 +1,27 @@
-from curses.textpad import rectangle
-from botAPI import WateringCan, Plant
-from navigation import Menu, TerminalMenu, Navigation, Nav
+from botAPI import WateringCan, Plant, CommandError, CircuitOpenError
+from breaker import CircuitBreaker, CLOSED
+from navigation import Menu, TerminalMenu, Navigation, Nav, Renderer, LogView, ListView, setup_curses_terminal
+from scheduler import Scheduler
+from cache import StatsCache
+from state import StateStore
+from plant_table import PlantTable
+from policy import POLICIES, LearnedCooldownPolicy
+from logbuffer import RingBufferHandler
+from logging.handlers import RotatingFileHandler
+from typing import Any, Callable, Dict, Tuple
+from metrics import Counter, Gauge, Histogram
+from profiling import PROFILER
+from control import ControlServer, ControlError
+from timeseries import ExpHistory
+from gateway import GatewayListener
+import remote
+import metrics
+import argparse
 import threading
+import signal
+import os
 import toml
 import time
-import random
 import curses
 import logging
 
@@ -29,39 +46,86 @@ def string_progressbar(iteration: int, total: int, prefix: str = '', suffix: str
     return f'{prefix}|{bar}| {percent}% {suffix}'
 
 
-class PlantWorker(threading.Thread, Menu):
+_waterings = Counter("flower_waterings_total", "Watering outcomes", ("outcome",))
+
+
+class PlantWorker(Menu):
     """
-    This class manages a plant and functions as a menu for showing plant info
+    This class keeps the watering state of a plant and functions as a menu for showing plant info, the watering
+    itself is run by the scheduler
     """
     global wc
-    global exit_event
+    global store
+    global table
+    global policy
+    global plant_tracker
 
     def __init__(self, t_plant: Plant, terminal: curses.window):
-        super(PlantWorker, self).__init__(daemon=True)
-        self.terminal = terminal
+        super(PlantWorker, self).__init__(terminal, t_plant.name)
         self.plant = t_plant
         self.log = logging.getLogger(f"{__name__}.{t_plant.name}")
         self.sleep_time = 1
         self.start_sleep = time.time()
-
-    def run(self) -> None:
-
-        while not exit_event.is_set():
+        self.lag = 0  # seconds the last watering started after its deadline
+        self.removed = False  # set once the plant is gone, to stop watering it
+        self.death_at = t_plant.death_at  # inf while unknown
+        self.projected_slack = float("inf")  # least time to death the plant would have had if watered on time
+        self.actual_slack = float("inf")  # least time to death the plant had when watered
+
+    def water(self) -> float:
+        """
+        Waters the plant and sets the cooldown
+        :return: the timestamp the plant should be watered again at, None if the plant was removed
+        """
+        if self.removed:
+            return None
+
+        with PROFILER.section(f"plant:{self.plant.name}"):
+            return self._water()
+
+    def priority(self) -> float:
+        """
+        :return: the plant watering rank, plants closer to death and with less nourishment rank first
+        """
+        return policy.rank(self.death_at, self.plant.level, self.plant.max_level)
+
+    def _water(self) -> float:
+        self.lag = max(time.time() - (self.start_sleep + self.sleep_time), 0)
+        if self.death_at != float("inf"):
+            self.projected_slack = min(self.projected_slack, self.death_at - (self.start_sleep + self.sleep_time))
+            self.actual_slack = min(self.actual_slack, self.death_at - time.time())
+
+        death = None
+        try:
             result = wc.water_plant(self.plant.name)
-            # set cooldown
-            if result[0]:
+        except CircuitOpenError:
+            # rescheduled as due, the scheduler holds it until commands resume
+            _waterings.inc("paused")
+            return time.time()
+        except CommandError as e:
+            self.log.warning("watering failed: %s", e)
+            _waterings.inc("error")
+            result = None  # retried like a watering the bot did not reply to
+        else:
+            if not result[0] and result[1] is None:
+                _waterings.inc("unrecognised")
+            elif result[0]:
+                _waterings.inc("success")
                 self.plant.level = min(self.plant.level + 1, self.plant.max_level)
-                self.sleep_time = random.randint(15 * 60,
-                                                 16 * 60 + 30)  # random between 15 and 16.5 minutes (plant cooldown)
+                death = self.death_at = float("inf")  # pushed back by the watering, known again on the next reconcile
             else:
-                self.sleep_time = result[1].tm_min * 60 + result[1].tm_sec + 1
-            self.start_sleep = time.time()
+                _waterings.inc("cooldown")
+        # set cooldown
+        self.start_sleep = time.time()
+        self.sleep_time = policy.next_delay(self.plant.name, result, self.start_sleep)
+
+        store.save_schedule(self.plant, self.start_sleep, self.sleep_time)
+        table.watered(self.plant.name, self.plant.level, self.start_sleep + self.sleep_time, death)
+        plant_tracker.update(self.plant.name)
 
-            self.log.debug(f"watering: success={result[0]} waiting {self.sleep_time} seconds")
+        self.log.debug("watering: success=%s waiting %s seconds", result is not None and result[0], self.sleep_time)
 
-            # wait for cooldown
-            while not exit_event.is_set() and time.time() <= self.start_sleep + self.sleep_time:
-                time.sleep(1)
+        return self.start_sleep + self.sleep_time
 
     def show(self, n: Navigation):
         # plant info
@@ -120,6 +184,13 @@ class PlantWorker(threading.Thread, Menu):
 
         time_left = self.start_sleep + self.sleep_time - time.time()
 
+        p_lag = f"last watering started {self.lag:.2f} seconds late"
+        self.terminal.addstr(
+            min(max(curses.LINES // 10 + 7, 0), curses.LINES - 1),
+            min(max(curses.COLS // 10, 0), curses.COLS - 1 - len(p_lag)),
+            p_lag
+        )
+
         p_cooldown = string_progressbar(int(time.time() - self.start_sleep), int(self.sleep_time),
                                         suffix=f" {int(time_left)} seconds left ({int(time_left//60)} "
                                                f"minutes and {int(time_left%60)} seconds)",
@@ -138,45 +209,98 @@ class PlantWorker(threading.Thread, Menu):
             back
         )
 
-        if self.terminal.getch() == curses.KEY_BACKSPACE:
+    def handle_key(self, n: Navigation, key: int):
+        if key == curses.KEY_BACKSPACE:
             n.navigate_up()
 
 
-class PlantTracker(TerminalMenu):
+class PlantTracker(ListView):
     """
-    This class tracks the current registered plants
+    This class lists the tracked plants, kept up to date by the workers and the reconciliation
     """
-    global threads
 
     def __init__(self, terminal_screen: curses.window):
-        self.choices = {f"{thread.plant.name} ({thread.plant.type})": thread for thread in threads}
-        super(PlantTracker, self).__init__(terminal_screen, self.choices, "Plant Tracker")
+        super(PlantTracker, self).__init__(terminal_screen, {
+            "name": lambda worker: worker.plant.name,
+            "type": lambda worker: (worker.plant.type, worker.plant.name),
+            "due": lambda worker: worker.start_sleep + worker.sleep_time,
+        }, self._label, self._detail, "Plant Tracker")
 
-    def show(self, n: Navigation):
-        self.choices = {f"{thread.plant.name} ({thread.plant.type})": thread for thread in threads}
-        super(PlantTracker, self).show(n)
+    @staticmethod
+    def _label(worker: PlantWorker) -> str:
+        return f"{worker.plant.name} ({worker.plant.type})"
+
+    @staticmethod
+    def _detail(worker: PlantWorker) -> str:
+        return f"level {worker.plant.level}/{worker.plant.max_level}, " \
+               f"due in {max(worker.start_sleep + worker.sleep_time - time.time(), 0):.0f}s"
+
+
+def reconcile_plants() -> float:
+    """
+    Fetches the user plants and brings the tracked ones in line: new plants get a worker and are watered right away,
+    gone plants stop being watered and the others get their info updated, keeping their schedule
+    :return: the timestamp the plants should be reconciled again at
+    """
+    global threads
+    global threads_lock
+
+    plants = stats.refresh("plants").result()  # also updates the cached plants
+    if plants is not None:
+        store.save_plants(plants)
+
+        with threads_lock:
+            tracked = {thread.plant.name: thread for thread in threads}
+            for plant in plants:
+                worker = tracked.pop(plant.name, None)
+                if worker is None:
+                    logging.getLogger(__name__).info("Tracking new plant \"%s\"", plant.name)
+                    worker = PlantWorker(plant, plant_tracker.terminal)
+                    threads.append(worker)
+                    table.add(plant, time.time())
+                    plant_tracker.add(plant.name, worker)
+                    scheduler.schedule(worker.water, time.time(), worker.priority)
+                else:
+                    worker.plant.type = plant.type
+                    worker.plant.level = plant.level
+                    worker.plant.max_level = plant.max_level
+                    worker.plant.death_timer = plant.death_timer
+                    worker.plant.alive_time = plant.alive_time
+                    worker.plant.fetched_at = plant.fetched_at
+                    worker.death_at = plant.death_at
+                    table.update(worker.plant)
+                    plant_tracker.update(plant.name)
+
+            for worker in tracked.values():
+                logging.getLogger(__name__).info("Plant \"%s\" is gone, no longer tracking it", worker.plant.name)
+                worker.removed = True
+                threads.remove(worker)
+                table.remove(worker.plant.name)
+                plant_tracker.remove(worker.plant.name)
+
+    return time.time() + config.get("reconcile_interval", 600)
 
 
 class InfoScreen(Menu):
     """
     This class shows info about stuff
     """
-    global wc
+    global stats
+    global table
+    global exp_history
 
     def __init__(self, terminal_screen: curses.window):
         super(InfoScreen, self).__init__(terminal_screen, "Info")
 
     def show(self, n: Nav):
 
-        back = "Press [BackSpace] to go back"
+        back = "Press [BackSpace] to go back, [R] to refresh"
         self.terminal.addstr(
             min(max(curses.LINES - 3, 0), curses.LINES - 1),
             min(3, curses.COLS - 1 - len(back)),
             back
         )
 
-        self.terminal.refresh()
-
         text = "EXP:"
         self.terminal.addstr(
             min(max(curses.LINES // 10, 0), curses.LINES - 1),
@@ -185,116 +309,460 @@ class InfoScreen(Menu):
             curses.color_pair(1) | curses.A_BOLD
         )
 
-        u_exp = str(wc.get_exp())
+        exp, age = stats.get("exp")
+        u_exp = f"{exp} (updated {int(age)} seconds ago)" if exp is not None else "..."
         self.terminal.addstr(
             min(max(curses.LINES // 10, 0), curses.LINES - 1),
             min(max(curses.COLS // 10 + len(text) + 1, 0), curses.COLS - 1 - len(u_exp)),
             u_exp
         )
 
-        if self.terminal.getch() == curses.KEY_BACKSPACE:  # backspace
+        text = "EXP/hour:"
+        self.terminal.addstr(
+            min(max(curses.LINES // 10 + 1, 0), curses.LINES - 1),
+            min(max(curses.COLS // 10, 0), curses.COLS - 1 - len(text)),
+            text,
+            curses.color_pair(1) | curses.A_BOLD
+        )
+
+        rates = [exp_history.rate(window) for window in (3600, 86400, 7 * 86400)]
+        u_rates = " / ".join("..." if rate is None else f"{rate:.0f}" for rate in rates) + " (hour / day / week)  " \
+                  + exp_history.sparkline()
+        self.terminal.addstr(
+            min(max(curses.LINES // 10 + 1, 0), curses.LINES - 1),
+            min(max(curses.COLS // 10 + len(text) + 1, 0), curses.COLS - 1 - len(u_rates)),
+            u_rates
+        )
+
+        text = "Due:"
+        self.terminal.addstr(
+            min(max(curses.LINES // 10 + 2, 0), curses.LINES - 1),
+            min(max(curses.COLS // 10, 0), curses.COLS - 1 - len(text)),
+            text,
+            curses.color_pair(1) | curses.A_BOLD
+        )
+
+        u_due = f"{len(table.due_by(time.time()))} of {len(table)} plants"
+        self.terminal.addstr(
+            min(max(curses.LINES // 10 + 2, 0), curses.LINES - 1),
+            min(max(curses.COLS // 10 + len(text) + 1, 0), curses.COLS - 1 - len(u_due)),
+            u_due
+        )
+
+        text = "Closest to death:"
+        self.terminal.addstr(
+            min(max(curses.LINES // 10 + 3, 0), curses.LINES - 1),
+            min(max(curses.COLS // 10, 0), curses.COLS - 1 - len(text)),
+            text,
+            curses.color_pair(1) | curses.A_BOLD
+        )
+
+        u_death = ", ".join(table.closest_to_death(3)) or "..."
+        self.terminal.addstr(
+            min(max(curses.LINES // 10 + 3, 0), curses.LINES - 1),
+            min(max(curses.COLS // 10 + len(text) + 1, 0), curses.COLS - 1 - len(u_death)),
+            u_death
+        )
+
+    def handle_key(self, n: Nav, key: int):
+        if key == curses.KEY_BACKSPACE:  # backspace
             n.navigate_up()
+        elif key in (ord("r"), ord("R")):
+            stats.refresh("exp")
 
 
-def setup_logging():
+class StatsScreen(Menu):
     """
-    Sets up logging for the program
+    This class shows the watering pipeline counters and latencies and the commands circuit breaker state, and toggles
+    profiling
     """
-    logging.basicConfig(format='%(levelname)s[%(name)s:%(funcName)s at %(asctime)s] %(message)s',
-                        datefmt='%m/%d/%y %I:%M:%S %p')
+    global config
+    global breaker
+
+    def __init__(self, terminal_screen: curses.window):
+        super(StatsScreen, self).__init__(terminal_screen, "Stats")
 
-    log = logging.getLogger(__name__)
+    def show(self, n: Nav):
+        lines = []
+        for metric in metrics.REGISTRY.metrics:
+            if isinstance(metric, Counter):
+                for name, labels, value in metric.samples():
+                    lines.append(f"{metric.description} {_label_text(labels)}: {int(value)}")
+            elif isinstance(metric, Gauge):
+                lines.append(f"{metric.description}: {metric.value():g}")
+            elif isinstance(metric, Histogram):
+                for values in metric.label_values():
+                    lines.append(f"{metric.description} {_label_text(dict(zip(metric.labels, values)))}: "
+                                 f"n={metric.count(*values)} mean={metric.mean(*values) * 1000:.1f}ms "
+                                 f"p50<={metric.quantile(.5, *values) * 1000:g}ms "
+                                 f"p95<={metric.quantile(.95, *values) * 1000:g}ms")
+
+        for i, line in enumerate(lines[:max(curses.LINES - curses.LINES // 10 - 6, 0)]):
+            line = line[:max(curses.COLS - curses.COLS // 10 - 1, 0)]
+            self.terminal.addstr(
+                min(max(curses.LINES // 10 + i, 0), curses.LINES - 1),
+                min(max(curses.COLS // 10, 0), curses.COLS - 1 - len(line)),
+                line
+            )
+
+        if breaker.state == CLOSED:
+            commands, attr = f"Commands flowing, paused {breaker.opened} times", 0
+        else:
+            commands = f"Commands paused ({breaker.state}), next try in {breaker.wait_time():.0f}s, " \
+                       f"last error: {breaker.last_error}"
+            attr = curses.color_pair(2) | curses.A_BOLD
+        self.terminal.addstr(
+            min(max(curses.LINES - 6, 0), curses.LINES - 1),
+            min(3, max(curses.COLS - 1 - len(commands), 0)),
+            commands[:curses.COLS - 1],
+            attr
+        )
 
-    log.setLevel(logging.WARNING)
+        if PROFILER.active:
+            profiling = f"Profiling, {int(PROFILER.remaining())} seconds left"
+        elif PROFILER.last_files:
+            profiling = f"Last profile: {', '.join(PROFILER.last_files)}"
+        else:
+            profiling = "Not profiling"
+        self.terminal.addstr(
+            min(max(curses.LINES - 5, 0), curses.LINES - 1),
+            min(3, max(curses.COLS - 1 - len(profiling), 0)),
+            profiling[:curses.COLS - 1]
+        )
 
+        back = "Press [BackSpace] to go back, [P] to start/stop profiling"
+        self.terminal.addstr(
+            min(max(curses.LINES - 3, 0), curses.LINES - 1),
+            min(3, curses.COLS - 1 - len(back)),
+            back
+        )
 
-def get_config() -> dict:
+    def handle_key(self, n: Nav, key: int):
+        if key == curses.KEY_BACKSPACE:
+            n.navigate_up()
+        elif key in (ord("p"), ord("P")):
+            # stopping waits for the profile to be written
+            threading.Thread(target=PROFILER.toggle, args=(config.get("profile_seconds", 60),), daemon=True).start()
+
+
+class SlackReport(Menu):
     """
-    Returns a dict representation of the config file
-    :return: configurations dict
+    This class shows how close to death each plant got, against how close it would have got if watered on time
     """
-    with open("config.toml", "r") as f:
-        return toml.load(f)
+    global threads
+    global threads_lock
+
+    def __init__(self, terminal_screen: curses.window):
+        super(SlackReport, self).__init__(terminal_screen, "Slack")
+
+    def show(self, n: Nav):
+        with threads_lock:
+            workers = sorted(threads, key=lambda w: w.actual_slack)
+
+        # plants watered with less slack than projected are shown in red
+        lines = [(f"{'Plant':<24} {'Projected':>12} {'Actual':>12}", curses.A_BOLD)]
+        for worker in workers:
+            lines.append((f"{worker.plant.name[:24]:<24} {_format_slack(worker.projected_slack):>12} "
+                          f"{_format_slack(worker.actual_slack):>12}",
+                          curses.color_pair(2) if worker.actual_slack < worker.projected_slack - 60 else 0))
+
+        for i, (line, attr) in enumerate(lines[:max(curses.LINES - curses.LINES // 10 - 4, 0)]):
+            line = line[:max(curses.COLS - curses.COLS // 10 - 1, 0)]
+            self.terminal.addstr(
+                min(max(curses.LINES // 10 + i, 0), curses.LINES - 1),
+                min(max(curses.COLS // 10, 0), curses.COLS - 1 - len(line)),
+                line,
+                attr
+            )
+
+        back = "Press [BackSpace] to go back"
+        self.terminal.addstr(
+            min(max(curses.LINES - 3, 0), curses.LINES - 1),
+            min(3, curses.COLS - 1 - len(back)),
+            back
+        )
+
+    def handle_key(self, n: Nav, key: int):
+        if key == curses.KEY_BACKSPACE:
+            n.navigate_up()
+
+
+def _format_slack(slack: float) -> str:
+    return "-" if slack == float("inf") else f"{int(slack // 60)}m"
+
 
+def _label_text(labels: dict) -> str:
+    return "(" + ", ".join(labels.values()) + ")" if labels else ""
 
-def setup_curses_terminal() -> curses.window:
+
+def fetch_exp() -> int:
+    """
+    Gets the exp, recording it in the exp history
+    :return: the current exp
+    """
+    exp = wc.get_exp()
+    if exp is not None:
+        exp_history.add(time.time(), exp)
+    return exp
+
+
+def sample_exp() -> float:
     """
-    Sets up the curses' module terminal and returns the window created
-    :return: a new curses terminal window
+    Samples the exp for the exp history
+    :return: the timestamp the exp should be sampled again at
     """
-    # setup terminal window
-    stdscr = curses.initscr()
-    stdscr.keypad(True)
+    stats.refresh("exp").result()
+    return time.time() + config.get("exp_sample_interval", 300)
 
-    curses.noecho()
-    curses.cbreak()
-    curses.start_color()
 
-    # set color
-    curses.init_pair(1, curses.COLOR_WHITE, curses.COLOR_BLACK)
-    curses.init_pair(2, curses.COLOR_RED, curses.COLOR_BLACK)
+def _plant_info(worker: PlantWorker) -> Dict[str, Any]:
+    return {
+        "name": worker.plant.name,
+        "type": worker.plant.type,
+        "level": worker.plant.level,
+        "max_level": worker.plant.max_level,
+        "due_at": worker.start_sleep + worker.sleep_time,
+        "death_at": worker.death_at if worker.death_at != float("inf") else None,
+        "lag": worker.lag,
+    }
 
-    return stdscr
+
+def control_commands() -> Dict[str, Callable[..., Any]]:
+    """
+    :return: the commands served on the control socket, see control.py
+    """
+    global threads
+    global threads_lock
+
+    def plants():
+        with threads_lock:
+            return [_plant_info(worker) for worker in threads]
+
+    def plant(name: str):
+        with threads_lock:
+            for worker in threads:
+                if worker.plant.name == name:
+                    info = _plant_info(worker)
+                    info["cooldown"] = max(info["due_at"] - time.time(), 0)  # seconds until it is watered again
+                    return info
+        raise KeyError(f"no plant named {name}")
+
+    def exp():
+        value, age = stats.get("exp")
+        return {"exp": value, "age": age, "per_hour": {"hour": exp_history.rate(3600), "day": exp_history.rate(86400),
+                                                        "week": exp_history.rate(7 * 86400)}}
+
+    def status():
+        return {"plants": len(threads), "pending": scheduler.pending(), "breaker": breaker.state,
+                "paused_for": breaker.wait_time(), "last_error": breaker.last_error}
+
+    def refresh(what: str = "plants"):
+        if what == "plants":
+            reconcile_plants()
+            return len(threads)
+        return stats.refresh(what).result()
+
+    def shutdown():
+        logging.getLogger(__name__).warning("Shutting down on request")
+        exit_event.set()
+        return True
+
+    return {"plants": plants, "plant": plant, "exp": exp, "status": status, "refresh": refresh, "shutdown": shutdown}
+
+
+def setup_logging(config: dict) -> Tuple[RingBufferHandler, logging.Handler]:
+    """
+    Sets up logging for the program. Records are kept in memory for the log view, as the terminal belongs to the UI,
+    and written to a rotating file when configured
+    :param config: configurations dict
+    :return: the in memory handler and the terminal handler (to remove once the UI starts)
+    """
+    formatter = logging.Formatter('%(levelname)s[%(name)s:%(funcName)s at %(asctime)s] %(message)s',
+                                  datefmt='%m/%d/%y %I:%M:%S %p')
+
+    buffer = RingBufferHandler(config.get("log_capacity", 1000))
+    terminal = logging.StreamHandler()
+    handlers = [buffer, terminal]
+    if config.get("log_file"):
+        handlers.append(RotatingFileHandler(config["log_file"], maxBytes=config.get("log_max_bytes", 1 << 20),
+                                            backupCount=config.get("log_backups", 3)))
+
+    root = logging.getLogger()
+    root.setLevel(config.get("log_level", "WARNING"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        root.addHandler(handler)
+
+    return buffer, terminal
+
+
+def get_config() -> dict:
+    """
+    Returns a dict representation of the config file
+    :return: configurations dict
+    """
+    with open("config.toml", "r") as f:
+        return toml.load(f)
 
 
 if __name__ == '__main__':
-    setup_logging()
+    parser = argparse.ArgumentParser(description="Waters the Flower bot plants")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without the terminal UI, controlled through the control socket")
+    parser.add_argument("--attach", action="store_true", help="attach the terminal UI to a running farm")
+    args = parser.parse_args()
+
     config = get_config()
+    if args.attach:
+        try:
+            remote.attach(config.get("control_socket", "flower.sock"), config.get("fps", 10))
+        except ControlError as e:
+            print(f"Could not attach to the farm: {e}")
+            exit(1)
+        exit(0)
+
+    log_buffer, log_terminal = setup_logging(config)
 
     # setup watering can
     print("Setting up watering can..")
-    wc = WateringCan(config["token"], config["channelID"])
-    print(plants := wc.get_plants())
+    breaker = CircuitBreaker(config.get("breaker_failures", 5), open_time=config.get("breaker_open_time", 30))
+    wc = WateringCan(config["token"], config["channelID"], config.get("workers", 4), config.get("timeout", 10),
+                     config.get("endpoint", WateringCan.ENDPOINT), config.get("feedback_timeout", 10),
+                     receive_mode=config.get("receive_mode", "poll"),
+                     gateway_url=config.get("gateway_url", GatewayListener.GATEWAY_URL), bot_id=config.get("bot_id"),
+                     breaker=breaker)
+
+    # prometheus metrics endpoint
+    try:
+        metrics.serve(config.get("metrics_port", 9101))
+    except OSError as e:
+        logging.getLogger(__name__).warning("Could not serve metrics: %s", e)
+
+    # profiling windows are opened from the stats menu, with SIGUSR1 or by setting FLOWER_PROFILE to the seconds to
+    # profile the startup for
+    PROFILER.directory = config.get("profile_dir", ".")
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda *_: threading.Thread(
+            target=PROFILER.toggle, args=(config.get("profile_seconds", 60),), daemon=True).start())
+    if os.environ.get("FLOWER_PROFILE"):
+        PROFILER.start(float(os.environ["FLOWER_PROFILE"]))
+
+    # plants are only fetched when the stored ones are stale
+    store = StateStore(config.get("state_file", "farm.db"))
+    if (plants := store.load_plants(config.get("plants_max_age", 3600))) is None:
+        plants = wc.get_plants()
+        store.save_plants(plants)
+    print(plants)
+
+    # bot queries shown on the UI, refreshed in the background, every exp fetched is kept in the exp history
+    exp_history = ExpHistory(config.get("exp_history_file", "exp.bin"))
+    stats = StatsCache({
+        "exp": (fetch_exp, config.get("exp_ttl", 60)),
+        "shop": (wc.get_shop, config.get("shop_ttl", 3600)),
+        "plants": (wc.get_plants, config.get("plants_ttl", 600))
+    })
 
     # workers
     exit_event = threading.Event()
     exit_event.clear()
 
+    policy_class = POLICIES[config.get("policy", "learned")]
+    if issubclass(policy_class, LearnedCooldownPolicy):
+        policy = policy_class(probe_every=config.get("probe_every", 0))
+    else:
+        policy = policy_class()
+
+    scheduler = Scheduler(exit_event, config.get("workers", 4), rate=config.get("watering_rate"),
+                          gate=breaker.wait_time)
+
     threads = []
+    threads_lock = threading.Lock()
+    table = PlantTable()  # the plants deadlines, for queries over every plant
 
-    print("Creating threads...")
+    print("Creating workers...")
     for plant in plants:
         threads.append(PlantWorker(plant, None))
 
+    # plants with a stored deadline still ahead resume from it, the others are checked right away
+    schedules = store.load_schedules()
+    start = time.time()
+    checks = 0
     for thread in threads:
-        print(f"Starting \"{thread.plant.name}\"s thread..")
-        time.sleep(.5)
-        thread.start()
+        if thread.plant.name in schedules and sum(schedules[thread.plant.name]) > start:
+            print(f"Resuming \"{thread.plant.name}\"..")
+            thread.start_sleep, thread.sleep_time = schedules[thread.plant.name]
+            scheduler.schedule(thread.water, thread.start_sleep + thread.sleep_time, thread.priority)
+        else:
+            print(f"Scheduling \"{thread.plant.name}\"..")
+            thread.start_sleep, thread.sleep_time = start, 1 + checks * .5  # spread the first waterings
+            scheduler.schedule(thread.water, thread.start_sleep + thread.sleep_time, thread.priority)
+            checks += 1
+
+        table.add(thread.plant, thread.start_sleep + thread.sleep_time)
 
     # setup navigation
     plant_tracker = PlantTracker(None)
-    info_screen = InfoScreen(None)
-    main_menu = TerminalMenu(None, {
-        plant_tracker.title: plant_tracker,
-        info_screen.title: info_screen
-    }, "Main Menu")
-    print({thread.plant.name: thread for thread in threads})
-
-    nav = Navigation(main_menu)
-
-    print("Setting up terminal UI")
-    time.sleep(.2)
-    # setup terminal
-    stdscr = setup_curses_terminal()
-
-    main_menu.terminal = stdscr
-    plant_tracker.terminal = stdscr
-    info_screen.terminal = stdscr
     for thread in threads:
-        thread.terminal = stdscr
-
-    while True:
-        rectangle(stdscr, 0, 0, curses.LINES - 2, curses.COLS - 2)
-
-        tooltip = "Press any key to update view"
-        stdscr.addstr(
-            curses.LINES - 3,
-            curses.COLS - 3 - len(tooltip),
-            tooltip,
-            curses.A_STANDOUT
-        )
-        nav.show()
-        stdscr.refresh()
-        time.sleep(.1)
-        stdscr.clear()
-        curses.update_lines_cols()
+        plant_tracker.add(thread.plant.name, thread)
+
+    scheduler.start()
+
+    if not args.headless:
+        info_screen = InfoScreen(None)
+        stats_screen = StatsScreen(None)
+        slack_report = SlackReport(None)
+        log_view = LogView(None, log_buffer)
+        main_menu = TerminalMenu(None, {
+            plant_tracker.title: plant_tracker,
+            info_screen.title: info_screen,
+            stats_screen.title: stats_screen,
+            slack_report.title: slack_report,
+            log_view.title: log_view
+        }, "Main Menu")
+        nav = Navigation(main_menu)
+
+        print("Setting up terminal UI")
+        time.sleep(.2)
+        # setup terminal, from now on the log is only kept in memory (and file)
+        logging.getLogger().removeHandler(log_terminal)
+        stdscr = setup_curses_terminal()
+
+        renderer = Renderer(stdscr, nav, config.get("fps", 10))
+
+        main_menu.terminal = renderer.canvas
+        plant_tracker.terminal = renderer.canvas
+        info_screen.terminal = renderer.canvas
+        stats_screen.terminal = renderer.canvas
+        slack_report.terminal = renderer.canvas
+        log_view.terminal = renderer.canvas
+        for thread in threads:
+            thread.terminal = renderer.canvas
+
+    # pick up bought and dead plants while running
+    scheduler.schedule(reconcile_plants, time.time() + config.get("reconcile_interval", 600))
+    scheduler.schedule(sample_exp, time.time())
+
+    # the UI can attach to the farm from another terminal, or after it was started headless
+    control = ControlServer(config.get("control_socket", "flower.sock"), control_commands())
+    try:
+        control.start()
+    except OSError as e:
+        logging.getLogger(__name__).warning("Could not serve the control socket: %s", e)
+
+    try:
+        if args.headless:
+            signal.signal(signal.SIGTERM, lambda *_: exit_event.set())
+            while not exit_event.wait(1):  # wakes up now and then for KeyboardInterrupt
+                pass
+        else:
+            renderer.run(exit_event)
+    finally:
+        if not args.headless:
+            curses.endwin()
+        control.close()
+        scheduler.stop()
+        stats.close()
+        exp_history.close()
+        wc.close()
+        store.close()
+        PROFILER.stop()
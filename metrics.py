@@ -0,0 +1,228 @@
+"""
+Counters, gauges and latency histograms of the watering pipeline, exposed in the Prometheus text format
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Dict, List, Tuple
+
+import bisect
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metric(object):
+
+    type = None
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        """
+        :param name: the metric name
+        :param description: the metric help text
+        :param labels: the label names, values are given in the same order when recording
+        """
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._lock = threading.Lock()
+
+        REGISTRY.register(self)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """
+        :return: the metric samples as (name, labels, value)
+        """
+        return []
+
+    def _label_dict(self, values: Tuple[str, ...], **extra) -> Dict[str, str]:
+        return dict(zip(self.labels, values), **extra)
+
+
+class Counter(Metric):
+
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        super(Counter, self).__init__(name, description, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self._label_dict(values), value) for values, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """
+    A value read when the metrics are collected, like the length of a queue
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, description: str, read: Callable[[], float] = None):
+        """
+        :param read: function returning the current value, the value is 0 while it is None
+        """
+        super(Gauge, self).__init__(name, description)
+        self.read = read
+
+    def value(self) -> float:
+        return self.read() if self.read is not None else 0
+
+    def samples(self):
+        return [(self.name, {}, self.value())]
+
+
+class Histogram(Metric):
+
+    type = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, description, labels)
+        self.buckets = buckets
+        self._values: Dict[Tuple[str, ...], List[float]] = {}  # label values -> [bucket counts..., +Inf, sum]
+
+    def observe(self, value: float, *label_values: str):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    def time(self, *label_values: str) -> "_Timer":
+        """
+        :return: a context manager observing the time spent inside it
+        """
+        return _Timer(self, label_values)
+
+    def count(self, *label_values: str) -> int:
+        counts = self._values.get(label_values)
+        return sum(counts[:-1]) if counts else 0
+
+    def mean(self, *label_values: str) -> float:
+        counts = self._values.get(label_values)
+        return counts[-1] / sum(counts[:-1]) if counts else 0
+
+    def quantile(self, q: float, *label_values: str) -> float:
+        """
+        Estimates a quantile from the buckets, as the upper bound of the bucket it falls in
+        """
+        with self._lock:
+            counts = list(self._values.get(label_values, ()))
+        if not counts:
+            return 0
+
+        rank = q * sum(counts[:-1])
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def label_values(self) -> List[Tuple[str, ...]]:
+        with self._lock:
+            return list(self._values.keys())
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for values, counts in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", self._label_dict(values, le=_format(bound)), cumulative))
+                samples.append((f"{self.name}_count", self._label_dict(values), cumulative))
+                samples.append((f"{self.name}_sum", self._label_dict(values), counts[-1]))
+        return samples
+
+
+class _Timer(object):
+
+    def __init__(self, histogram: Histogram, label_values: Tuple[str, ...]):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        """
+        :return: every metric in the Prometheus text format
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {_format(value)}" if label_text else f"{name} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        data = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("content-type", "text/plain; version=0.0.4")
+        self.send_header("content-length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serves the metrics on http://<host>:<port>/metrics in the background
+    :param port: the port to listen on
+    :param host: the host to listen on
+    :return: the server
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def _format(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
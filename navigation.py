@@ -1,5 +1,12 @@
+import bisect
 import curses
-from typing import Union, Dict
+import logging
+import threading
+import time
+from curses.textpad import rectangle
+from typing import Union, Dict, Tuple, List, Callable, Any
+
+from logbuffer import RingBufferHandler
 
 
 class Nav(object):
@@ -7,6 +14,9 @@ class Nav(object):
     def show(self):
         pass
 
+    def handle_key(self, key: int):
+        pass
+
     def start(self, starting_menu):
         pass
 
@@ -29,6 +39,9 @@ class Menu(object):
     def show(self, n: Nav):
         pass
 
+    def handle_key(self, n: Nav, key: int):
+        pass
+
 
 class Navigation(Nav):
 
@@ -40,6 +53,9 @@ class Navigation(Nav):
     def show(self):
         self.currentMenu.show(self)
 
+    def handle_key(self, key: int):
+        self.currentMenu.handle_key(self, key)
+
     def navigate_up(self):
         if len(self.back_stack):
             m = self.back_stack.pop()
@@ -76,9 +92,7 @@ class TerminalMenu(Menu):
                 curses.color_pair(1) | curses.A_UNDERLINE | curses.A_BOLD
             )
 
-        choices = {}
-
-        for i, (m_choice, func) in enumerate(self.choices.items()):
+        for i, m_choice in enumerate(self.choices.keys()):
             prefix = f"{i+1}. "
             text = f"{prefix}{m_choice}"
             self.terminal.addstr(
@@ -87,8 +101,6 @@ class TerminalMenu(Menu):
                 text
             )
 
-            choices.update({i+1: func})
-
         back = "Press [BackSpace] to go back"
         self.terminal.addstr(
             min(max(curses.LINES - 3, 0), curses.LINES - 1),
@@ -96,7 +108,10 @@ class TerminalMenu(Menu):
             back
         )
 
-        if chr(choice := self.terminal.getch()).isnumeric():
+    def handle_key(self, n: Navigation, choice: int):
+        choices = {i+1: func for i, func in enumerate(self.choices.values())}
+
+        if chr(choice).isnumeric():
             if (choice := int(chr(choice))) in choices.keys():
                 c = choices[choice]
                 if isinstance(c, tuple):
@@ -112,4 +127,406 @@ class TerminalMenu(Menu):
             n.navigate_up()
 
 
+class LogView(Menu):
+    """
+    Shows the latest log records, newest at the bottom, scrolled a record at a time or a page at a time
+    """
+
+    def __init__(self, terminal_screen: curses.window, buffer: RingBufferHandler, title="Log"):
+        super(LogView, self).__init__(terminal_screen, title)
+        self.buffer = buffer
+        self.offset = 0  # records scrolled up from the newest, 0 follows new records
+
+    def show(self, n: Nav):
+        height = max(curses.LINES - 4, 0)
+        width = max(curses.COLS - 1, 0)
+        records = self.buffer.snapshot()
+        self.offset = min(self.offset, max(len(records) - 1, 0))
+
+        # only the records on screen are formatted, from the newest shown upwards
+        lines = []
+        for record in reversed(records[:len(records) - self.offset]):
+            if len(lines) >= height:
+                break
+            attr = curses.color_pair(2) if record.levelno >= logging.WARNING else 0
+            lines[:0] = [(line[:width], attr) for line in self.buffer.format(record).splitlines()]
+
+        for i, (line, attr) in enumerate(lines[-height:] if height else []):
+            self.terminal.addstr(i, 0, line, attr)
+
+        back = f"[{len(records) - self.offset}/{len(records)}] Press [BackSpace] to go back, " \
+               f"[Up]/[Down]/[PgUp]/[PgDn] to scroll, [End] to follow"
+        self.terminal.addstr(
+            min(max(curses.LINES - 3, 0), curses.LINES - 1),
+            min(3, max(curses.COLS - 1 - len(back), 0)),
+            back[:width]
+        )
+
+    def handle_key(self, n: Nav, key: int):
+        page = max(curses.LINES - 4, 1)
+        if key == curses.KEY_BACKSPACE:
+            n.navigate_up()
+        elif key == curses.KEY_UP:
+            self.offset += 1
+        elif key == curses.KEY_DOWN:
+            self.offset = max(self.offset - 1, 0)
+        elif key == curses.KEY_PPAGE:
+            self.offset += page
+        elif key == curses.KEY_NPAGE:
+            self.offset = max(self.offset - page, 0)
+        elif key == curses.KEY_END:
+            self.offset = 0
+
+
+class ListView(Menu):
+    """
+    A scrollable list of keyed items, for lists longer than the screen. The items are kept in an index sorted by the
+    chosen sort key, updated an item at a time, and only the rows in view are laid out, so a frame costs the same with
+    ten items or thousands. Entries can be picked by moving the cursor or typing their number, and filtered by typing a
+    search after [/].
+    """
+
+    def __init__(self, terminal_screen: curses.window, sort_keys: Dict[str, Callable[[Any], Any]],
+                 label: Callable[[Any], str], detail: Callable[[Any], str] = None, title=None):
+        """
+        :param terminal_screen: the terminal window
+        :param sort_keys: sort name -> function giving the sort value of an item, the first one is the default
+        :param label: gives the text of an item, searched by the filter
+        :param detail: gives the text shown after the label, only called for the rows in view
+        :param title: the list title
+        """
+        super(ListView, self).__init__(terminal_screen, title)
+        self.sort_keys = sort_keys
+        self.sort = next(iter(sort_keys))
+        self.label = label
+        self.detail = detail
+
+        self.query = ""  # the filter, matched case insensitively against the labels
+        self.searching = False  # whether typed keys go to the filter
+        self.number = ""  # the entry number being typed
+        self.cursor = 0  # position of the highlighted entry in the filtered list
+        self.top = 0  # position of the first entry in view
+
+        self._items: Dict[str, Any] = {}
+        self._labels: Dict[str, str] = {}  # lower case, for searching
+        self._values: Dict[str, Any] = {}  # the sort value each item is indexed with
+        self._index: List[Tuple[Any, str]] = []  # (sort value, key) of every item, sorted
+        self._version = 0  # bumped on every index change
+        self._filtered: Tuple[int, str, List[str]] = (-1, "", [])  # (version, query, keys) of the last filtering
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, key: str, item):
+        """
+        Adds an item, or re-indexes it if already present
+        :param key: the item key, unique
+        :param item: the item
+        """
+        with self._lock:
+            self._unindex(key)
+            self._items[key] = item
+            self._labels[key] = self.label(item).lower()
+            self._insert(key)
+
+    def update(self, key: str):
+        """
+        Re-indexes an item after its label or sort value changed
+        :param key: the item key
+        """
+        with self._lock:
+            if key in self._items:
+                self._unindex(key)
+                self._labels[key] = self.label(self._items[key]).lower()
+                self._insert(key)
+
+    def remove(self, key: str):
+        """
+        :param key: the key of the item to remove
+        """
+        with self._lock:
+            self._unindex(key)
+            self._items.pop(key, None)
+            self._labels.pop(key, None)
+
+    def sort_by(self, sort: str):
+        """
+        :param sort: the name of the sort key to order the list by
+        """
+        with self._lock:
+            self.sort = sort
+            self._values = {}
+            self._index = []
+            for key in self._items:
+                self._values[key] = self.sort_keys[sort](self._items[key])
+            self._index = sorted((value, key) for key, value in self._values.items())
+            self._version += 1
+
+    def select(self, n: Nav, item):
+        """
+        Called when an entry is picked, navigates to the item if it is a menu
+        :param n: the navigation
+        :param item: the picked item
+        """
+        if isinstance(item, Menu):
+            n.navigate_down_to(item)
+
+    def window(self, start: int, count: int) -> Tuple[int, List[str]]:
+        """
+        :param start: position of the first entry to get
+        :param count: how many entries to get
+        :return: the number of entries passing the filter and the keys of the requested ones
+        """
+        if self.query:
+            keys = self.visible()
+            return len(keys), keys[start:start + count]
+        with self._lock:  # unfiltered, the window is read straight from the index
+            return len(self._index), [key for _, key in self._index[start:start + count]]
+
+    def visible(self) -> List[str]:
+        """
+        :return: the keys of the entries passing the filter, in order
+        """
+        with self._lock:
+            if not self.query:
+                return [key for _, key in self._index]
+
+            version, query, keys = self._filtered
+            if version == self._version and query == self.query:
+                return keys
+            if version != self._version or not self.query.startswith(query):
+                keys = [key for _, key in self._index]  # start over from every entry
+            if self.query:
+                needle = self.query.lower()
+                keys = [key for key in keys if needle in self._labels[key]]
+            self._filtered = (self._version, self.query, keys)
+            return keys
+
+    def show(self, n: Nav):
+        height = max(curses.LINES - 7, 1)
+        width = max(curses.COLS - 4, 0)
+        total, _ = self.window(0, 0)
+
+        self.cursor = min(max(self.cursor, 0), max(total - 1, 0))
+        self.top = min(max(self.top, self.cursor - height + 1), self.cursor)
+        total, keys = self.window(self.top, height)
 
+        if self.title:
+            self.terminal.addstr(1, max(curses.COLS // 2 - len(self.title) // 2, 0), self.title,
+                                 curses.color_pair(1) | curses.A_UNDERLINE | curses.A_BOLD)
+
+        digits = len(str(total))
+        for row, key in enumerate(keys):
+            position = self.top + row
+            item = self._items.get(key)
+            if item is None:  # removed since filtered
+                continue
+            text = f"{position + 1:>{digits}}. {self.label(item)}"
+            if self.detail is not None:
+                text = f"{text}  {self.detail(item)}"
+            self.terminal.addstr(3 + row, 2, text[:width], curses.A_REVERSE if position == self.cursor else 0)
+
+        status = f"[{min(self.cursor + 1, total)}/{total}] sort: {self.sort}"
+        if self.query or self.searching:
+            status += f"  filter: /{self.query}{'_' if self.searching else ''}"
+        if self.number:
+            status += f"  go to: {self.number}"
+        self.terminal.addstr(min(max(curses.LINES - 4, 0), curses.LINES - 1), 3, status[:width])
+
+        back = "Press [BackSpace] to go back, [Enter] to open, [/] to filter, [Tab] to sort"
+        self.terminal.addstr(
+            min(max(curses.LINES - 3, 0), curses.LINES - 1),
+            min(3, max(curses.COLS - 1 - len(back), 0)),
+            back[:width]
+        )
+
+    def handle_key(self, n: Nav, key: int):
+        if self.searching:
+            self._handle_search_key(key)
+            return
+
+        page = max(curses.LINES - 7, 1)
+        if key in (curses.KEY_ENTER, 10, 13):
+            if self.number:
+                self.cursor = int(self.number) - 1
+                self.number = ""
+            _, keys = self.window(self.cursor, 1) if self.cursor >= 0 else (0, [])
+            if keys and (item := self._items.get(keys[0])) is not None:
+                self.select(n, item)
+        elif key == curses.KEY_BACKSPACE:
+            if self.number:
+                self.number = self.number[:-1]
+            elif self.query:
+                self.query = ""
+            else:
+                n.navigate_up()
+        elif 0 <= key < 256 and chr(key).isdigit():
+            self.number += chr(key)
+            self.cursor = int(self.number) - 1
+        elif key == ord("/"):
+            self.searching = True
+            self.number = ""
+        elif key == ord("\t"):
+            sorts = list(self.sort_keys)
+            self.sort_by(sorts[(sorts.index(self.sort) + 1) % len(sorts)])
+        elif key == curses.KEY_UP:
+            self.cursor -= 1
+        elif key == curses.KEY_DOWN:
+            self.cursor += 1
+        elif key == curses.KEY_PPAGE:
+            self.cursor -= page
+        elif key == curses.KEY_NPAGE:
+            self.cursor += page
+        elif key == curses.KEY_HOME:
+            self.cursor = 0
+        elif key == curses.KEY_END:
+            self.cursor = self.window(0, 0)[0] - 1
+
+    def _handle_search_key(self, key: int):
+        if key in (curses.KEY_ENTER, 10, 13, 27):  # enter or escape, keeping the filter
+            self.searching = False
+        elif key == curses.KEY_BACKSPACE:
+            if self.query:
+                self.query = self.query[:-1]
+            else:
+                self.searching = False
+        elif 32 <= key < 127:
+            self.query += chr(key)
+        else:
+            return
+        self.cursor = self.top = 0
+
+    def _insert(self, key: str):
+        value = self._values[key] = self.sort_keys[self.sort](self._items[key])
+        bisect.insort(self._index, (value, key))
+        self._version += 1
+
+    def _unindex(self, key: str):
+        value = self._values.pop(key, None)
+        if value is None:
+            return
+        i = bisect.bisect_left(self._index, (value, key))
+        if i < len(self._index) and self._index[i][1] == key:
+            del self._index[i]
+        self._version += 1
+
+
+class Canvas(object):
+    """
+    Stands in for the terminal window while a frame is drawn, collecting the drawn text by position
+    """
+
+    def __init__(self):
+        self.segments: Dict[Tuple[int, int], Tuple[str, int]] = {}
+
+    def addstr(self, y: int, x: int, text: str, attr: int = 0):
+        self.segments[(y, x)] = (text, attr)
+
+    def clear(self):
+        self.segments = {}
+
+
+class Renderer(object):
+    """
+    Draws the current menu at a capped frame rate, only rewriting the text that changed since the last frame, and feeds
+    the pressed keys to the menu without blocking
+    """
+
+    def __init__(self, screen: curses.window, navigation: Nav, fps: float = 10):
+        """
+        :param screen: the terminal window
+        :param navigation: the navigation to draw the current menu of
+        :param fps: the maximum frames per second
+        """
+        self.screen = screen
+        self.navigation = navigation
+        self.frame_time = 1 / fps
+        self.canvas = Canvas()  # the terminal the menus draw on
+        self.frame_cost = 0  # seconds, moving average
+
+        self._drawn: Dict[Tuple[int, int], Tuple[str, int]] = {}
+        self._full_redraw = True
+
+        screen.nodelay(True)
+
+    def run(self, stop: threading.Event = None):
+        """
+        Draws frames until the navigation exits
+        :param stop: event also ending the drawing when set
+        """
+        while stop is None or not stop.is_set():
+            start = time.perf_counter()
+            self.frame()
+            time.sleep(max(self.frame_time - (time.perf_counter() - start), 0))
+
+    def frame(self):
+        start = time.perf_counter()
+
+        while (key := self.screen.getch()) != -1:
+            if key == curses.KEY_RESIZE:
+                curses.update_lines_cols()
+                self._full_redraw = True
+            else:
+                self.navigation.handle_key(key)
+
+        self.canvas.clear()
+        self.navigation.show()
+
+        stats = f" frame {self.frame_cost * 1000:.2f}ms "
+        self.canvas.addstr(curses.LINES - 3, curses.COLS - 3 - len(stats), stats, curses.A_STANDOUT)
+
+        self._draw(self.canvas.segments)
+        self.screen.noutrefresh()
+        curses.doupdate()
+
+        self.frame_cost = self.frame_cost * .9 + (time.perf_counter() - start) * .1
+
+    def _draw(self, segments: Dict[Tuple[int, int], Tuple[str, int]]):
+        if self._full_redraw:
+            self.screen.erase()
+            rectangle(self.screen, 0, 0, curses.LINES - 2, curses.COLS - 2)
+            self._drawn = {}
+            self._full_redraw = False
+
+        # blank what is gone, text overlapping the blanked ranges has to be drawn again
+        blanked: Dict[int, List[Tuple[int, int]]] = {}
+        for (y, x), (text, _) in self._drawn.items():
+            new = segments.get((y, x))
+            if new is None or len(new[0]) < len(text):
+                start = x + (len(new[0]) if new else 0)
+                self._addstr(y, start, " " * (x + len(text) - start), 0)
+                blanked.setdefault(y, []).append((start, x + len(text)))
+
+        for (y, x), (text, attr) in segments.items():
+            overlaps = any(s < x + len(text) and x < e for s, e in blanked.get(y, ()))
+            if overlaps or self._drawn.get((y, x)) != (text, attr):
+                self._addstr(y, x, text, attr)
+
+        self._drawn = dict(segments)
+
+    def _addstr(self, y: int, x: int, text: str, attr: int):
+        try:
+            self.screen.addstr(y, x, text, attr)
+        except curses.error:  # out of the window (or on its last cell)
+            pass
+
+
+def setup_curses_terminal() -> curses.window:
+    """
+    Sets up the curses' module terminal and returns the window created
+    :return: a new curses terminal window
+    """
+    # setup terminal window
+    stdscr = curses.initscr()
+    stdscr.keypad(True)
+
+    curses.noecho()
+    curses.cbreak()
+    curses.start_color()
+
+    # set color
+    curses.init_pair(1, curses.COLOR_WHITE, curses.COLOR_BLACK)
+    curses.init_pair(2, curses.COLOR_RED, curses.COLOR_BLACK)
+
+    return stdscr
@@ -0,0 +1,140 @@
+"""
+Column store of the tracked plants, for scanning thousands of plants without going through their workers.
+NumPy is used for the scans when installed.
+"""
+from array import array
+from typing import Dict, List
+
+from botAPI import Plant
+
+try:
+    import numpy
+except ImportError:  # scans fall back to plain python
+    numpy = None
+
+import heapq
+import threading
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class PlantTable(object):
+    """
+    Keeps the level, max level, next watering time and death time of each plant in parallel arrays, one row per plant.
+    Rows are not kept in any order, removing a plant moves the last row into its place.
+    """
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.level = array("i")
+        self.max_level = array("i")
+        self.due = array("d")  # the time each plant is watered next at
+        self.death = array("d")  # the time each plant dies at if not watered, inf if unknown
+
+        self._rows: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name: str):
+        return name in self._rows
+
+    def add(self, plant: Plant, due: float):
+        """
+        Adds a plant, or updates it if already present
+        :param plant: the plant
+        :param due: the time the plant is watered next at
+        """
+        with self._lock:
+            if plant.name in self._rows:
+                row = self._rows[plant.name]
+                self.level[row], self.max_level[row] = plant.level, plant.max_level
+                self.due[row], self.death[row] = due, plant.death_at
+                return
+
+            self._rows[plant.name] = len(self.names)
+            self.names.append(plant.name)
+            self.level.append(plant.level)
+            self.max_level.append(plant.max_level)
+            self.due.append(due)
+            self.death.append(plant.death_at)
+
+    def update(self, plant: Plant):
+        """
+        Updates the level and death time of a plant, keeping its next watering time
+        :param plant: the plant
+        """
+        with self._lock:
+            row = self._rows.get(plant.name)
+            if row is not None:
+                self.level[row], self.max_level[row], self.death[row] = plant.level, plant.max_level, plant.death_at
+
+    def watered(self, name: str, level: int, due: float, death: float = None):
+        """
+        Records a watering of a plant
+        :param name: the plant name
+        :param level: the plant level after the watering
+        :param due: the time the plant is watered next at
+        :param death: the time the plant dies at if not watered, None to keep the current one
+        """
+        with self._lock:
+            row = self._rows.get(name)
+            if row is not None:
+                self.level[row], self.due[row] = level, due
+                if death is not None:
+                    self.death[row] = death
+
+    def remove(self, name: str):
+        """
+        :param name: the name of the plant to remove
+        """
+        with self._lock:
+            row = self._rows.pop(name, None)
+            if row is None:
+                return
+
+            last = len(self.names) - 1
+            for column in (self.names, self.level, self.max_level, self.due, self.death):
+                column[row] = column[last]
+                column.pop()
+            if row != last:
+                self._rows[self.names[row]] = row
+
+    def due_by(self, when: float) -> List[str]:
+        """
+        :param when: a timestamp
+        :return: the names of the plants due to be watered by the given time
+        """
+        with self._lock:
+            if numpy is not None:
+                rows = numpy.flatnonzero(numpy.frombuffer(self.due, dtype=numpy.float64) <= when)
+            else:
+                rows = [row for row, due in enumerate(self.due) if due <= when]
+            return [self.names[row] for row in rows]
+
+    def closest_to_death(self, n: int) -> List[str]:
+        """
+        :param n: how many plants to get
+        :return: the names of the n plants dying the soonest, soonest first
+        """
+        with self._lock:
+            if numpy is not None and len(self.names) > n:
+                death = numpy.frombuffer(self.death, dtype=numpy.float64)
+                rows = numpy.argpartition(death, n)[:n]
+                rows = rows[numpy.argsort(death[rows])]
+            else:
+                rows = heapq.nsmallest(n, range(len(self.names)), key=self.death.__getitem__)
+            return [self.names[row] for row in rows]
+
+    def next_due(self) -> float:
+        """
+        :return: the earliest next watering time, inf if there are no plants
+        """
+        with self._lock:
+            if not self.names:
+                return float("inf")
+            if numpy is not None:
+                return float(numpy.frombuffer(self.due, dtype=numpy.float64).min())
+            return min(self.due)
@@ -0,0 +1,208 @@
+"""
+Watering policies: when a plant is watered again after a watering, and which due plants are watered first. Shared by
+the plant workers and the virtual farm (simulator.VirtualFarm), so a policy can be compared before deploying it.
+"""
+from collections import deque
+from typing import Dict, Tuple, Type, Union
+
+from metrics import Counter, Gauge
+
+import random
+import statistics
+import threading
+
+
+# what WateringCan.water_plant returns: (watered, cooldown seconds left), None if the bot did not reply
+WateringResult = Union[Tuple[bool, Union[int, None]], None]
+
+
+class WateringPolicy(object):
+    """
+    Waters again a random 15 to 16.5 minutes after a success, and one second after the cooldown reported by the bot
+    otherwise
+    """
+
+    NO_FEEDBACK_RETRY = 60  # seconds to wait before retrying when the bot did not reply
+    MIN_DELAY = 15 * 60  # seconds waited after a success, at least
+    MAX_DELAY = 16 * 60 + 30  # and at most
+    NOURISHMENT_WEIGHT = 15 * 60  # an unnourished plant is ranked as if dying this many seconds earlier
+
+    def __init__(self, rng: random.Random = None):
+        """
+        :param rng: the random number generator, for reproducible runs
+        """
+        self.random = rng or random.Random()
+
+    def next_delay(self, plant_name: str, result: WateringResult, now: float) -> float:
+        """
+        :param plant_name: the watered plant
+        :param result: the watering result
+        :param now: the time the watering finished at
+        :return: seconds to wait before watering the plant again
+        """
+        if result is None or (not result[0] and result[1] is None):
+            return self.NO_FEEDBACK_RETRY
+        if result[0]:
+            return self.random.randint(self.MIN_DELAY, self.MAX_DELAY)  # plant cooldown
+        return result[1] + 1
+
+    def rank(self, death_at: float, level: int, max_level: int) -> float:
+        """
+        :param death_at: the time the plant dies at if not watered, inf if unknown
+        :param level: the plant nourishment level
+        :param max_level: the plant max nourishment level
+        :return: the plant watering rank, plants closer to death and with less nourishment rank first
+        """
+        return death_at - (1 - level / max(max_level, 1)) * self.NOURISHMENT_WEIGHT
+
+
+class FixedDelayPolicy(WateringPolicy):
+    """
+    Waters again a fixed delay after a success, e.g. right after a known cooldown
+    """
+
+    def __init__(self, delay: float = 15 * 60 + 1, rng: random.Random = None):
+        """
+        :param delay: seconds to wait after a success
+        :param rng: the random number generator, for reproducible runs
+        """
+        super(FixedDelayPolicy, self).__init__(rng)
+        self.delay = delay
+
+    def next_delay(self, plant_name: str, result: WateringResult, now: float) -> float:
+        if result is not None and result[0]:
+            return self.delay
+        return super(FixedDelayPolicy, self).next_delay(plant_name, result, now)
+
+
+_wasted = Counter("flower_wasted_waterings_total", "Waterings rejected because the plant was still on cooldown")
+_idle_seconds = Counter("flower_idle_seconds_total",
+                        "Seconds plants could have been watered but were not, by the learned cooldown")
+_wasted_saved = Gauge("flower_wasted_waterings_saved", "Rejected waterings saved against the random policy")
+_idle_seconds_saved = Gauge("flower_idle_seconds_saved", "Idle seconds saved against the random policy")
+_probes = Counter("flower_cooldown_probes_total", "Waterings sent early to check the learned cooldown", ("result",))
+
+
+class _PlantCooldown(object):
+    """
+    What was observed of a plant cooldown
+    """
+
+    def __init__(self):
+        self.watered_at = None  # the time of the last successful watering, None if unknown (e.g. lost reply)
+        self.last_succeeded = False  # whether the last watering succeeded, so a rejection right after measures
+        self.rejected = 0  # rejections since the last successful watering
+        self.successes = 0
+        self.probing = False  # whether the last watering was sent early to check the cooldown
+        self.cooldown = None  # the cooldown last measured on the plant
+
+
+class LearnedCooldownPolicy(WateringPolicy):
+    """
+    Waters again right after the cooldown, learned from the waterings: a rejection right after a success measures the
+    cooldown (the time between them plus the wait reported by the bot), and two successes bound it from above. Each
+    plant uses its own measure, or the median of the recent measures on any plant while it has none, so a single
+    rejection teaches every plant.
+    A learned cooldown only goes down when a plant is watered sooner than it allows. Optionally, every probe_every
+    successes a plant is watered well before its cooldown, so a cooldown learned too long (or one the bot shortened) is
+    measured again instead of kept forever: a rejected check measures the cooldown exactly and costs a command but no
+    idle time, a successful one bounds it and is followed by another check. Checks are counted apart from the wasted
+    waterings.
+    """
+
+    MARGIN = 1  # seconds waited past the learned cooldown, the bot reports the wait rounded to the second
+    SAMPLES = 20  # recent measures the shared cooldown is taken from
+    PROBE_FACTOR = .5  # fraction of the cooldown a check is sent after
+
+    def __init__(self, cooldown: float = 15 * 60, rng: random.Random = None, probe_every: int = 0):
+        """
+        :param cooldown: the cooldown assumed until one is measured
+        :param rng: the random number generator, for reproducible runs
+        :param probe_every: successes between waterings sent early to check the cooldown, 0 to never check it
+        """
+        super(LearnedCooldownPolicy, self).__init__(rng)
+        self.initial = cooldown
+        self.probe_every = probe_every
+        self.wasted_saved = 0.  # against the random policy, expected for the same cooldowns
+        self.idle_seconds_saved = 0.
+        self._plants: Dict[str, _PlantCooldown] = {}
+        self._measures = deque(maxlen=self.SAMPLES)
+        self._lock = threading.Lock()
+
+        _wasted_saved.read = lambda: self.wasted_saved
+        _idle_seconds_saved.read = lambda: self.idle_seconds_saved
+
+    def cooldown(self, plant_name: str = None) -> float:
+        """
+        :param plant_name: the plant, None for the cooldown shared by every plant
+        :return: the learned cooldown in seconds
+        """
+        with self._lock:
+            return self._cooldown(self._plants.get(plant_name))
+
+    def next_delay(self, plant_name: str, result: WateringResult, now: float) -> float:
+        with self._lock:
+            plant = self._plants.setdefault(plant_name, _PlantCooldown())
+
+            if result is None or (not result[0] and result[1] is None):
+                # the plant may have been watered, what comes next can not be measured from the last success
+                plant.watered_at, plant.last_succeeded, plant.rejected, plant.probing = None, False, 0, False
+                return self.NO_FEEDBACK_RETRY
+
+            if not result[0]:
+                if plant.probing:
+                    _probes.inc("rejected")
+                else:
+                    _wasted.inc()
+                    plant.rejected += 1
+                if plant.last_succeeded:
+                    self._measure(plant, now + result[1] - plant.watered_at)
+                plant.last_succeeded = plant.probing = False
+                return result[1] + self.MARGIN
+
+            if plant.watered_at is not None:
+                gap = now - plant.watered_at
+                if gap < self._cooldown(plant):  # watered sooner than thought possible
+                    self._measure(plant, gap)
+                self._account(gap, plant.rejected, self._cooldown(plant))
+
+            if plant.probing:
+                _probes.inc("watered")
+            plant.watered_at, plant.last_succeeded, plant.rejected = now, True, 0
+            plant.successes += 1
+            # checked until rejected
+            plant.probing = plant.probing or (self.probe_every > 0 and plant.successes % self.probe_every == 0)
+            if plant.probing:
+                return self._cooldown(plant) * self.PROBE_FACTOR
+            return self._cooldown(plant) + self.MARGIN
+
+    def _account(self, gap: float, rejected: int, cooldown: float):
+        """
+        Counts the idle seconds and rejections between two successful waterings, and what they would have been with
+        the random policy for the same cooldown
+        """
+        idle = max(gap - cooldown, 0)
+        _idle_seconds.inc(amount=idle)
+
+        # the random policy waits MIN_DELAY to MAX_DELAY, when too soon it is rejected and waters a second after
+        delays = range(self.MIN_DELAY, self.MAX_DELAY + 1)
+        too_soon = sum(1 for delay in delays if delay < cooldown)
+        random_idle = (sum(delay - cooldown for delay in delays if delay >= cooldown) + too_soon) / len(delays)
+        self.wasted_saved += too_soon / len(delays) - rejected
+        self.idle_seconds_saved += random_idle - idle
+
+    def _cooldown(self, plant: Union[_PlantCooldown, None]) -> float:
+        if plant is not None and plant.cooldown is not None:
+            return plant.cooldown
+        return statistics.median(self._measures) if self._measures else self.initial
+
+    def _measure(self, plant: _PlantCooldown, cooldown: float):
+        plant.cooldown = cooldown
+        self._measures.append(cooldown)
+
+
+POLICIES: Dict[str, Type[WateringPolicy]] = {
+    "random": WateringPolicy,
+    "fixed": FixedDelayPolicy,
+    "learned": LearnedCooldownPolicy,
+}
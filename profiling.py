@@ -0,0 +1,222 @@
+"""
+On-demand profiling of the running farm. While a profiling window is open, the tagged sections (plant waterings and
+bot commands) run under cProfile and every thread stack is sampled, producing a pstats file and a collapsed stacks
+file (one "frame;frame;... count" line per stack, for flamegraph.pl or speedscope) when the window closes.
+Coroutines run on an event loop thread for a section (see Profiler.carry) are profiled and tagged as part of it.
+"""
+from contextlib import contextmanager
+from typing import Coroutine, Dict, List, Tuple, Union
+
+import collections
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class _Section(threading.local):
+    """
+    The profiling state of a thread
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.profile: Union[cProfile.Profile, None] = None
+        self.session = None
+
+
+class Profiler(object):
+    """
+    Profiles the tagged sections for a bounded window of time, started and stopped at runtime
+    """
+
+    def __init__(self, directory: str = ".", interval: float = .005):
+        """
+        :param directory: where the profile files are written to
+        :param interval: seconds between stack samples
+        """
+        self.directory = directory
+        self.interval = interval
+        self.last_files: Tuple[str, ...] = ()  # the files written by the last window
+
+        self._lock = threading.Lock()
+        self._session = 0  # profiles of a closed window are discarded
+        self._deadline = None
+        self._stop = threading.Event()
+        self._sampler: Union[threading.Thread, None] = None
+        self._profiles: List[cProfile.Profile] = []
+        self._stacks = collections.Counter()
+        self._tags: Dict[int, List[str]] = {}  # thread id -> tags of the sections it is in
+        self._carried: Dict[object, Tuple[str, ...]] = {}  # frame running a carried coroutine -> tags it carries
+        self._local = _Section()
+
+    @property
+    def active(self) -> bool:
+        return self._deadline is not None
+
+    def remaining(self) -> float:
+        """
+        :return: seconds left in the profiling window, 0 if not profiling
+        """
+        deadline = self._deadline
+        return max(deadline - time.time(), 0) if deadline is not None else 0
+
+    def start(self, duration: float) -> bool:
+        """
+        Opens a profiling window
+        :param duration: seconds the window stays open for
+        :return: whether the window was opened, False if already profiling
+        """
+        with self._lock:
+            if self.active:
+                return False
+
+            self._session += 1
+            self._deadline = time.time() + duration
+            self._stop = threading.Event()
+            self._profiles = []
+            self._stacks = collections.Counter()
+            self._sampler = threading.Thread(target=self._run, args=(self._stop,), name="profiler", daemon=True)
+            self._sampler.start()
+
+        log.warning("Profiling for %s seconds", duration)
+        return True
+
+    def stop(self) -> Tuple[str, ...]:
+        """
+        Closes the profiling window early and waits for its files to be written
+        :return: the files written
+        """
+        with self._lock:
+            sampler = self._sampler
+            self._stop.set()
+        if sampler is not None and sampler is not threading.current_thread():
+            sampler.join()
+        return self.last_files
+
+    def toggle(self, duration: float):
+        """
+        Opens a profiling window, or closes the open one
+        :param duration: seconds the window stays open for
+        """
+        if not self.start(duration):
+            self.stop()
+
+    @contextmanager
+    def section(self, tag: str):
+        """
+        Marks a section of code to profile, sections can be nested and their tags prefix the sampled stacks
+        :param tag: the section tag, like "plant:rose" or "command:p.water"
+        """
+        if not self.active and self._local.depth == 0:
+            yield
+            return
+
+        ident = threading.get_ident()
+        tags = self._tags.setdefault(ident, [])
+        tags.append(tag)
+        self._enter()
+        try:
+            yield
+        finally:
+            tags.pop()
+            if self._local.depth == 1:
+                del self._tags[ident]
+            self._exit()
+
+    def carry(self, coroutine: Coroutine) -> Coroutine:
+        """
+        Carries the sections the calling thread is in into a coroutine it runs on an event loop thread: the loop thread
+        is profiled while the coroutine runs, and the samples of the coroutine are tagged with the sections
+        :param coroutine: the coroutine to run on the event loop
+        :return: the coroutine to run instead
+        """
+        tags = tuple(self._tags.get(threading.get_ident(), ()))
+        if not tags or not self.active:
+            return coroutine
+        return self._run_carried(coroutine, tags)
+
+    async def _run_carried(self, coroutine: Coroutine, tags: Tuple[str, ...]):
+        frame = sys._getframe()  # on the stack of the loop thread whenever the coroutine runs
+        self._carried[frame] = tags
+        self._enter()  # concurrent coroutines share the profile of the loop thread
+        try:
+            return await coroutine
+        finally:
+            del self._carried[frame]
+            self._exit()
+
+    def _enter(self):
+        local = self._local
+        local.depth += 1
+        if local.depth == 1 and self.active:
+            local.session = self._session
+            local.profile = cProfile.Profile()
+            try:
+                local.profile.enable()
+            except ValueError:  # another profiler is running on this thread
+                local.profile = None
+
+    def _exit(self):
+        local = self._local
+        local.depth -= 1
+        if local.depth == 0 and local.profile is not None:
+            local.profile.disable()
+            with self._lock:
+                if local.session == self._session and self.active:
+                    self._profiles.append(local.profile)
+            local.profile = None
+
+    def _run(self, stop: threading.Event):
+        own = threading.get_ident()
+        while not stop.wait(self.interval) and time.time() < self._deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self._stacks[self._collapse(ident, frame)] += 1
+
+        with self._lock:
+            self._deadline = None
+            profiles, stacks = self._profiles, self._stacks
+            self._profiles, self._stacks = [], collections.Counter()
+
+        try:
+            self.last_files = self._write(profiles, stacks)
+            log.warning("Profile written to %s", ", ".join(self.last_files))
+        except OSError:
+            log.exception("Could not write the profile")
+
+    def _collapse(self, ident: int, frame) -> str:
+        frames, carried = [], ()
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            carried = self._carried.get(frame, ()) + carried
+            frame = frame.f_back
+        return ";".join(list(self._tags.get(ident, ())) + list(carried) + frames[::-1])
+
+    def _write(self, profiles: List[cProfile.Profile], stacks: collections.Counter) -> Tuple[str, ...]:
+        os.makedirs(self.directory, exist_ok=True)
+        prefix = os.path.join(self.directory, time.strftime("profile-%Y%m%d-%H%M%S"))
+        files = []
+
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(f"{prefix}.pstats")
+            files.append(f"{prefix}.pstats")
+
+        with open(f"{prefix}.folded", "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        files.append(f"{prefix}.folded")
+
+        return tuple(files)
+
+
+PROFILER = Profiler()
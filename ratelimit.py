@@ -0,0 +1,171 @@
+from typing import Callable, Dict, Mapping, Union
+from collections import deque
+
+import asyncio
+import math
+import re
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+_major_parameter = re.compile(r"/(channels|guilds|webhooks)/(\d+)")
+
+
+class _Bucket:
+    """
+    The state of a rate limit bucket as last reported by the api
+    """
+
+    def __init__(self):
+        self.limit = None  # unknown until the api reports it, inf for a route answered without limits
+        self.remaining = None
+        self.reset_at = 0
+        self.window = 0  # length of the rate limit window
+        self.probing = False  # a request was sent to discover the limits, the others wait for its response
+
+
+class RateLimiter:
+    """
+    Keeps track of the discord api rate limits, per route bucket (from the response headers) and globally, making
+    requests wait for a free slot instead of being sent into a 429
+    """
+
+    def __init__(self, global_limit: float = 50, clock: Callable[[], float] = time.time):
+        """
+        :param global_limit: maximum requests per second across all routes, inf for no limit
+        :param clock: function returning the current time in seconds
+        """
+        self.global_limit = global_limit
+        self.clock = clock
+
+        self._route_buckets: Dict[str, str] = {}  # route -> bucket key
+        self._buckets: Dict[str, _Bucket] = {}
+        self._global_reset_at = 0
+        self._sent = deque()  # send times within the last second
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    PROBE_POLL_INTERVAL = .05  # seconds between checks of a wait for a probing request to be reported
+
+    async def acquire_async(self, route: str):
+        """
+        Waits, without blocking the event loop, until a request can be sent on a route and takes its slot
+        :param route: the request route, in the format "<METHOD> <path>"
+        """
+        with self._lock:
+            self._waiting += 1
+        try:
+            while True:
+                with self._lock:
+                    wait = self._wait_time(route, self.clock())
+                    if wait is not None and wait <= 0:
+                        self._take(route)
+                        return
+                log.debug("Waiting %s seconds for a slot on %s", wait, route)
+                await asyncio.sleep(self.PROBE_POLL_INTERVAL if wait is None else wait)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def update(self, route: str, status_code: int, headers: Mapping[str, str]):
+        """
+        Updates the route bucket with the rate limit info of a response
+        :param route: the request route
+        :param status_code: the response status code
+        :param headers: the response headers
+        """
+        now = self.clock()
+
+        with self._lock:
+            bucket_hash = headers.get("X-RateLimit-Bucket")
+            if bucket_hash:
+                key = f"{bucket_hash}:{self._major(route)}"
+                self._route_buckets[route] = key
+                self._buckets.setdefault(key, _Bucket())
+
+            bucket = self._bucket(route)
+            bucket.probing = False
+
+            if "X-RateLimit-Remaining" in headers:
+                remaining = int(headers["X-RateLimit-Remaining"])
+                reset_after = float(headers.get("X-RateLimit-Reset-After", 0))
+                reset_at = now + reset_after
+
+                # requests sent after this one already took their slots, unless the bucket was reset in between
+                new_window = reset_at > bucket.reset_at + .5
+                bucket.remaining = remaining if new_window or bucket.remaining is None \
+                    else min(bucket.remaining, remaining)
+                bucket.reset_at = reset_at
+                bucket.window = max(bucket.window, reset_after)
+                bucket.limit = int(headers.get("X-RateLimit-Limit", remaining + 1))
+            elif bucket.limit is None and status_code != 429:
+                bucket.limit = math.inf  # answered without limits, the route is not probed again
+
+            if status_code == 429:
+                retry_after = float(headers.get("Retry-After", headers.get("X-RateLimit-Reset-After", 1)))
+                if headers.get("X-RateLimit-Global"):
+                    self._global_reset_at = now + retry_after
+                else:
+                    bucket.remaining = 0
+                    bucket.reset_at = now + retry_after
+                log.warning("Rate limited on %s, retrying after %s seconds (global=%s)", route, retry_after,
+                            bool(headers.get("X-RateLimit-Global")))
+
+    def release(self, route: str):
+        """
+        Gives back the probe of a route after a request that got no response (e.g. timed out), the next request probes
+        the route limits instead
+        :param route: the request route
+        """
+        with self._lock:
+            self._bucket(route).probing = False
+
+    def queue_depth(self) -> int:
+        """
+        :return: the number of requests waiting for a slot
+        """
+        with self._lock:
+            return self._waiting
+
+    def _take(self, route: str):
+        bucket = self._bucket(route)
+        if bucket.remaining is not None:
+            bucket.remaining -= 1
+        elif bucket.limit is None:
+            bucket.probing = True
+        self._sent.append(self.clock())
+
+    def _wait_time(self, route: str, now: float) -> Union[float, None]:
+        """
+        :return: the seconds to wait before sending on the route, None to wait for a response to be reported
+        """
+        wait = self._global_reset_at - now
+
+        while self._sent and self._sent[0] <= now - 1:
+            self._sent.popleft()
+        if len(self._sent) >= self.global_limit:
+            wait = max(wait, self._sent[0] + 1 - now)
+
+        bucket = self._bucket(route)
+        if bucket.probing:
+            return None
+        if bucket.remaining is not None and bucket.remaining <= 0:
+            if bucket.reset_at > now:
+                wait = max(wait, bucket.reset_at - now)
+            else:  # the window was reset
+                bucket.remaining = bucket.limit
+                bucket.reset_at = now + bucket.window
+        return wait
+
+    def _bucket(self, route: str) -> _Bucket:
+        key = self._route_buckets.get(route, route)
+        if key not in self._buckets:
+            self._buckets[key] = _Bucket()
+        return self._buckets[key]
+
+    @staticmethod
+    def _major(route: str) -> str:
+        match = _major_parameter.search(route)
+        return match.group(0) if match else ""
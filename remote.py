@@ -0,0 +1,229 @@
+"""
+Terminal UI attached to a running farm through its control socket (see control.py), started with
+`python main.py --attach`. The farm keeps watering when the UI detaches, and is only asked for what is on screen.
+"""
+from typing import Any, Dict, List, Union
+
+from breaker import CLOSED
+from control import ControlClient, ControlError
+from navigation import Menu, TerminalMenu, Navigation, Nav, Renderer, ListView, setup_curses_terminal
+
+import curses
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class RemoteFarm(object):
+    """
+    The farm seen through its control socket, answers are reused for a short while so redrawing the screen does not
+    query the farm every frame
+    """
+
+    def __init__(self, client: ControlClient, max_age: float = 1):
+        """
+        :param client: the control socket client
+        :param max_age: seconds an answer is reused for
+        """
+        self.client = client
+        self.max_age = max_age
+        self.error: Union[str, None] = None  # why the last query failed, None if it did not
+
+        self._answers: Dict[tuple, tuple] = {}  # (command, args) -> (time, result)
+
+    def get(self, command: str, **args) -> Any:
+        """
+        :param command: the command name
+        :param args: the command arguments
+        :return: the last result of the command, None if it never succeeded
+        """
+        key = (command, tuple(sorted(args.items())))
+        fetched_at, result = self._answers.get(key, (0, None))
+        if time.time() - fetched_at >= self.max_age:
+            try:
+                result = self.client.call(command, **args)
+                self.error = None
+            except ControlError as e:
+                self.error = str(e)
+            self._answers[key] = (time.time(), result)  # failures are not retried every frame either
+        return result
+
+    def call_in_background(self, command: str, **args):
+        """
+        Runs a command without waiting for it, like refreshing the plants which waits for the bot
+        """
+        def call():
+            try:
+                ControlClient(self.client.path, self.client.timeout).call(command, **args)
+            except ControlError as e:
+                self.error = str(e)
+
+        threading.Thread(target=call, name=f"control-{command}", daemon=True).start()
+
+
+def _field(terminal, row: int, label: str, value: str):
+    terminal.addstr(
+        min(max(curses.LINES // 10 + row, 0), curses.LINES - 1),
+        min(max(curses.COLS // 10, 0), curses.COLS - 1 - len(label)),
+        label,
+        curses.color_pair(1) | curses.A_BOLD
+    )
+    terminal.addstr(
+        min(max(curses.LINES // 10 + row, 0), curses.LINES - 1),
+        min(max(curses.COLS // 10 + len(label) + 1, 0), curses.COLS - 1 - len(value)),
+        value
+    )
+
+
+def _error(terminal, farm: RemoteFarm):
+    if farm.error:
+        error = f"Farm unreachable: {farm.error}"[:max(curses.COLS - 4, 0)]
+        terminal.addstr(min(max(curses.LINES - 5, 0), curses.LINES - 1), 3, error, curses.color_pair(2))
+
+
+def _footer(terminal, text: str, farm: RemoteFarm):
+    _error(terminal, farm)
+    terminal.addstr(
+        min(max(curses.LINES - 3, 0), curses.LINES - 1),
+        min(3, max(curses.COLS - 1 - len(text), 0)),
+        text
+    )
+
+
+def _seconds(timestamp: Union[float, None]) -> str:
+    return "unknown" if timestamp is None else f"{max(timestamp - time.time(), 0):.0f}s"
+
+
+class RemotePlant(Menu):
+    """
+    Shows a plant of the farm
+    """
+
+    def __init__(self, terminal_screen: curses.window, farm: RemoteFarm, name: str):
+        super(RemotePlant, self).__init__(terminal_screen, name)
+        self.farm = farm
+
+    def show(self, n: Nav):
+        plant = self.farm.get("plant", name=self.title)
+        if plant is not None:
+            _field(self.terminal, 0, "Name:", plant["name"])
+            _field(self.terminal, 1, "Type:", plant["type"])
+            _field(self.terminal, 2, "Level:", f"{plant['level']}/{plant['max_level']}")
+            _field(self.terminal, 3, "Cooldown:", f"{plant['cooldown']:.0f}s")
+            _field(self.terminal, 4, "Dies in:", _seconds(plant["death_at"]))
+            _field(self.terminal, 5, "Last watering lag:", f"{plant['lag']:.1f}s")
+        _footer(self.terminal, "Press [BackSpace] to go back", self.farm)
+
+    def handle_key(self, n: Nav, key: int):
+        if key == curses.KEY_BACKSPACE:
+            n.navigate_up()
+
+
+class RemotePlantTracker(ListView):
+    """
+    Lists the plants of the farm, synced with it once per refresh interval while shown
+    """
+
+    def __init__(self, terminal_screen: curses.window, farm: RemoteFarm):
+        super(RemotePlantTracker, self).__init__(terminal_screen, {
+            "name": lambda plant: plant["name"],
+            "type": lambda plant: (plant["type"], plant["name"]),
+            "due": lambda plant: plant["due_at"],
+        }, lambda plant: f"{plant['name']} ({plant['type']})",
+            lambda plant: f"level {plant['level']}/{plant['max_level']}, due in {_seconds(plant['due_at'])}",
+            "Plant Tracker")
+        self.farm = farm
+        self._synced: Union[List[dict], None] = None  # the plants last synced, unchanged answers are not re-indexed
+
+    def show(self, n: Nav):
+        plants = self.farm.get("plants")
+        if plants is not None and plants is not self._synced:
+            self._sync(plants)
+        super(RemotePlantTracker, self).show(n)
+        _error(self.terminal, self.farm)
+
+    def select(self, n: Nav, item):
+        n.navigate_down_to(RemotePlant(self.terminal, self.farm, item["name"]))
+
+    def _sync(self, plants: List[dict]):
+        self._synced = plants
+        names = set()
+        for plant in plants:
+            names.add(plant["name"])
+            if self._items.get(plant["name"]) != plant:
+                self.add(plant["name"], plant)
+        for name in [name for name in self._items if name not in names]:
+            self.remove(name)
+
+
+class RemoteInfo(Menu):
+    """
+    Shows the farm exp and state
+    """
+
+    def __init__(self, terminal_screen: curses.window, farm: RemoteFarm):
+        super(RemoteInfo, self).__init__(terminal_screen, "Info")
+        self.farm = farm
+
+    def show(self, n: Nav):
+        exp = self.farm.get("exp") or {}
+        status = self.farm.get("status") or {}
+
+        u_exp = f"{exp['exp']} (updated {int(exp['age'])} seconds ago)" if exp.get("exp") is not None else "..."
+        _field(self.terminal, 0, "EXP:", u_exp)
+        rates = [exp.get("per_hour", {}).get(window) for window in ("hour", "day", "week")]
+        _field(self.terminal, 1, "EXP/hour:", " / ".join("..." if rate is None else f"{rate:.0f}" for rate in rates)
+               + " (hour / day / week)")
+        _field(self.terminal, 2, "Plants:", f"{status.get('plants', '...')} ({status.get('pending', '...')} jobs)")
+        if status.get("breaker", CLOSED) == CLOSED:
+            _field(self.terminal, 3, "Commands:", "flowing")
+        else:
+            _field(self.terminal, 3, "Commands:", f"paused ({status['breaker']}) for {status['paused_for']:.0f}s, "
+                                                  f"last error: {status['last_error']}")
+        _footer(self.terminal, "Press [BackSpace] to go back, [R] to refresh the plants, [E] to refresh the exp",
+                self.farm)
+
+    def handle_key(self, n: Nav, key: int):
+        if key == curses.KEY_BACKSPACE:
+            n.navigate_up()
+        elif key in (ord("r"), ord("R")):
+            self.farm.call_in_background("refresh", what="plants")
+        elif key in (ord("e"), ord("E")):
+            self.farm.call_in_background("refresh", what="exp")
+
+
+def attach(path: str, fps: float = 10):
+    """
+    Runs the terminal UI against the farm serving on a control socket, until the UI is left or the farm stopped
+    :param path: the control socket path
+    :param fps: the maximum frames per second
+    """
+    client = ControlClient(path)
+    client.call("status")  # fails early if no farm is running
+    farm = RemoteFarm(client)
+    detached = threading.Event()
+
+    def stop_farm():
+        client.call("shutdown")
+        detached.set()
+
+    tracker = RemotePlantTracker(None, farm)
+    info = RemoteInfo(None, farm)
+    main_menu = TerminalMenu(None, {
+        tracker.title: tracker,
+        info.title: info,
+        "Stop the farm": (stop_farm, None)
+    }, "Main Menu (attached)")
+
+    stdscr = setup_curses_terminal()
+    renderer = Renderer(stdscr, Navigation(main_menu), fps)
+    for menu in (main_menu, tracker, info):
+        menu.terminal = renderer.canvas
+
+    try:
+        renderer.run(detached)
+    finally:
+        curses.endwin()
+        client.close()
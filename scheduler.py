@@ -0,0 +1,153 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Union, List, Tuple
+
+from metrics import Histogram
+
+import heapq
+import itertools
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+_lag_seconds = Histogram("flower_scheduler_lag_seconds", "Time jobs started after their deadline")
+
+# a job runs once when it is due and returns the timestamp it should run again at (None to stop scheduling it)
+Job = Callable[[], Union[float, None]]
+# gives the rank of a due job, the due jobs with the lowest rank run first
+Priority = Callable[[], float]
+
+
+class Scheduler:
+    """
+    Runs jobs at their deadlines using a single timer thread and a bounded pool of workers. Jobs that are due wait in
+    a ready queue ranked by their priority, and are started at most at the given rate, while the gate lets them.
+    """
+
+    RETRY_DELAY = 30  # seconds to wait before re-running a job that raised
+
+    def __init__(self, exit_event: threading.Event, max_workers: int = 4, clock: Callable[[], float] = time.time,
+                 rate: float = None, gate: Callable[[], float] = None):
+        """
+        :param exit_event: event signaling the scheduler to shut down
+        :param max_workers: maximum number of jobs running at the same time
+        :param clock: function returning the current time in seconds
+        :param rate: maximum number of jobs started per second, None for no limit
+        :param gate: function returning the seconds starting jobs is paused for (0 to start them), like an open circuit
+        breaker
+        """
+        self.exit_event = exit_event
+        self.max_workers = max_workers
+        self.clock = clock
+        self.rate = rate
+        self.gate = gate
+
+        self._heap: List[Tuple[float, int, Job, Priority]] = []  # jobs waiting for their deadline
+        self._ready: List[Tuple[float, int, float, Job, Priority]] = []  # due jobs, by priority
+        self._next_start = 0  # the time the next job can start at, under the rate
+        self._counter = itertools.count()  # tie breaker so jobs are never compared
+        self._running = 0
+        self._cv = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="scheduler-worker")
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+
+    def schedule(self, job: Job, when: float, priority: Priority = None):
+        """
+        Schedules a job
+        :param job: the job to run
+        :param when: the timestamp to run the job at
+        :param priority: ranks the job once due, kept when the job is rescheduled, due jobs without one rank by deadline
+        """
+        with self._cv:
+            heapq.heappush(self._heap, (when, next(self._counter), job, priority))
+            self._cv.notify()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """
+        Signals the scheduler to stop and waits for the timer thread to finish, running jobs are not interrupted
+        """
+        self.exit_event.set()
+        with self._cv:
+            self._cv.notify_all()
+        if self._thread.is_alive():
+            self._thread.join()
+        self._pool.shutdown(wait=False)
+
+    def pending(self) -> int:
+        """
+        :return: the number of jobs waiting for their deadline or to be started
+        """
+        with self._cv:
+            return len(self._heap) + len(self._ready)
+
+    def run_virtual(self, until: float):
+        """
+        Runs the jobs inline on the calling thread until the given time, jumping the clock from one deadline to the
+        next instead of waiting, so days of scheduling take seconds. The clock must be a virtual one, with an
+        advance(seconds) method (see simulator.VirtualClock).
+        :param until: the timestamp to stop at
+        """
+        with self._cv:
+            while not self.exit_event.is_set():
+                now = self.clock()
+                delay = self._dispatch(now, self._execute)
+                if delay is None or now + delay > until:
+                    self.clock.advance(max(until - now, 0))
+                    return
+                self.clock.advance(delay)
+
+    def _run(self):
+        with self._cv:
+            while not self.exit_event.is_set():
+                self._cv.wait(self._dispatch(self.clock(), self._submit))
+
+    def _dispatch(self, now: float, start: Callable[[Job, float, Priority], None]) -> Union[float, None]:
+        """
+        Moves the due jobs to the ready queue and starts the ones allowed by the workers and the rate
+        :param now: the current time
+        :param start: starts a job, given the job, its deadline and its priority
+        :return: seconds until a job can be started, None if there are no jobs
+        """
+        while True:
+            while self._heap and self._heap[0][0] <= now:
+                when, seq, job, priority = heapq.heappop(self._heap)
+                rank = priority() if priority is not None else when
+                heapq.heappush(self._ready, (rank, seq, when, job, priority))
+
+            if not self._ready or self._running >= self.max_workers or self._next_start > now:
+                break
+            if self.gate is not None and (paused := self.gate()) > 0:
+                return paused
+
+            _, _, when, job, priority = heapq.heappop(self._ready)
+            # allows a burst of up to a second worth of jobs after being idle
+            self._next_start = max(self._next_start, now - 1) + 1 / self.rate if self.rate else 0
+            self._running += 1
+            start(job, when, priority)
+
+        delays = [self._heap[0][0] - now] if self._heap else []
+        if self._ready and self._running < self.max_workers:
+            delays.append(self._next_start - now)
+        return min(delays) if delays else None
+
+    def _submit(self, job: Job, when: float, priority: Priority):
+        self._pool.submit(self._execute, job, when, priority)
+
+    def _execute(self, job: Job, when: float, priority: Priority):
+        _lag_seconds.observe(max(self.clock() - when, 0))
+
+        try:
+            when = job()
+        except Exception:
+            log.exception("Job %s failed, retrying in %s seconds", job, self.RETRY_DELAY)
+            when = self.clock() + self.RETRY_DELAY
+
+        with self._cv:
+            self._running -= 1
+            if when is not None and not self.exit_event.is_set():
+                heapq.heappush(self._heap, (when, next(self._counter), job, priority))
+            self._cv.notify()
@@ -0,0 +1,727 @@
+"""
+Local stand-in for the discord api endpoints used by the watering can, with a simulated Flower bot replying to the
+commands. Run with `python simulator.py` and point the farm "endpoint" config at it, with `--gateway-port 8081` the
+channel messages are also pushed on a gateway stand-in (point the "gateway_url" config at it, with receive_mode =
+"gateway").
+The virtual farm drives the same bot model with the farm scheduler and a watering policy on a virtual clock, to compare
+policies over days of simulated time in seconds.
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Tuple, Union
+from urllib.parse import urlparse, parse_qs
+
+import argparse
+import base64
+import bisect
+import hashlib
+import heapq
+import itertools
+import json
+import random
+import re
+import socket
+import socketserver
+import struct
+import threading
+import time
+import uuid
+import logging
+
+from botAPI import _parse_watering_message
+from gateway import GatewayListener
+from policy import WateringPolicy
+from scheduler import Scheduler
+
+import flower_messages
+
+log = logging.getLogger(__name__)
+
+DISCORD_EPOCH = 1420070400000  # ms
+USER_ID = "1"
+BOT_ID = flower_messages.BOT_ID
+
+_messages_path = re.compile(r"/api/v\d+/channels/(?P<channel>\d+)/messages")
+
+
+class SimulatedPlant:
+    """
+    The bot side state of a plant
+    """
+
+    def __init__(self, name: str, plant_type: str, max_level: int, born: float, death_time: float):
+        self.name = name
+        self.type = plant_type
+        self.level = 0
+        self.max_level = max_level
+        self.born = born
+        self.last_watered = float("-inf")
+        self.death_at = born + death_time
+
+
+class SimulatedBot:
+    """
+    Replies to the Flower bot commands like the real bot does: watering has a cooldown, plants die if not watered in
+    time and each successful watering gives exp
+    """
+
+    PLANT_TYPES = ("Sunflower", "Cactus", "Rose", "Tulip")
+
+    def __init__(self, plants: int, cooldown: float = 900, death_time: float = 2 * 86400, now: float = None):
+        """
+        :param plants: the number of plants the user starts with, named plant0 to plant<n-1>
+        :param cooldown: seconds a plant has to wait between waterings
+        :param death_time: seconds a plant survives without water
+        :param now: the simulation start time
+        """
+        now = time.time() if now is None else now
+
+        self.cooldown = cooldown
+        self.death_time = death_time
+        self.exp = 0
+        self.plants: Dict[str, SimulatedPlant] = {
+            f"plant{i}": SimulatedPlant(f"plant{i}", self.PLANT_TYPES[i % len(self.PLANT_TYPES)], 10, now, death_time)
+            for i in range(plants)
+        }
+        self._next_death = now + death_time  # no plant dies before this time
+        self.shop = {"Sunflower": 100, "Cactus": 250, "Rose": 1500, "Tulip": 4000}
+        self.items = {"Fertilizer": 50, "Sprinkler": 3000}
+
+    def reply(self, command: str, now: float) -> Union[dict, None]:
+        """
+        :param command: the command content
+        :param now: the time the command is handled at
+        :return: the reply message (without id), None if the message is not a command
+        """
+        self._bury(now)
+
+        if command.startswith("p.water "):
+            return self._water(command[len("p.water "):].strip(), now)
+        if command == "p.exp":
+            return flower_messages.exp(self.exp)
+        if command == "p.shop":
+            return flower_messages.shop(self.shop, self.items)
+        if command == "p.plants":
+            return flower_messages.plants([(p.name, p.type, p.level, p.max_level, int(p.death_at - now),
+                                            int(now - p.born)) for p in self.plants.values()])
+        return None
+
+    def _water(self, name: str, now: float) -> dict:
+        plant = self.plants.get(name)
+        if plant is None:
+            return flower_messages.no_plant(name)
+
+        wait = plant.last_watered + self.cooldown - now
+        if wait > 0:
+            return flower_messages.water_cooldown(int(wait) + 1)
+
+        plant.last_watered = now
+        plant.level = min(plant.level + 1, plant.max_level)
+        plant.death_at = now + self.death_time
+        self.exp += 10 * plant.level
+        return flower_messages.water_success(name)
+
+    def _bury(self, now: float):
+        if now < self._next_death:
+            return
+
+        for name in [name for name, p in self.plants.items() if p.death_at <= now]:
+            del self.plants[name]
+        self._next_death = min((p.death_at for p in self.plants.values()), default=float("inf"))
+
+
+class VirtualClock(object):
+    """
+    A clock that only moves when advanced, for running the scheduler on simulated time
+    """
+
+    def __init__(self, now: float = 0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class VirtualFarm(object):
+    """
+    Waters the plants of a simulated bot with the farm scheduler and a watering policy, on a virtual clock. Commands
+    are handled by the bot as soon as they are started (no latency or lost replies) and the plants death times are
+    known as if reconciled after every watering.
+    """
+
+    def __init__(self, plants: int, policy: WateringPolicy, rate: float = None, cooldown: float = 900,
+                 death_time: float = 2 * 86400, start: float = 0):
+        """
+        :param plants: the number of plants
+        :param policy: the watering policy
+        :param rate: maximum number of waterings started per second, None for no limit
+        :param cooldown: seconds the bot makes a plant wait between waterings
+        :param death_time: seconds a plant survives without water
+        :param start: the simulation start time
+        """
+        self.policy = policy
+        self.start = start
+        self.clock = VirtualClock(start)
+        self.bot = SimulatedBot(plants, cooldown, death_time, start)
+        self.scheduler = Scheduler(threading.Event(), max_workers=1, clock=self.clock, rate=rate)
+
+        self.stats = {"plants": plants, "commands": 0, "watered": 0, "wasted": 0, "idle_seconds": 0.,
+                      "peak_per_minute": 0, "deaths": 0}
+        self._minute = (None, 0)  # (minute, commands sent in it)
+
+        for name in list(self.bot.plants):
+            self.scheduler.schedule(self._worker(name), start, self._priority(name))
+
+    def run(self, seconds: float) -> Dict[str, float]:
+        """
+        Runs the farm for the given simulated time
+        :param seconds: the simulated time
+        :return: the farm stats, with the request rate in commands per second
+        """
+        until = self.clock() + seconds
+        self.scheduler.run_virtual(until)
+        self.bot._bury(until)
+
+        stats = dict(self.stats, deaths=self.stats["plants"] - len(self.bot.plants))
+        # the plants ready to be watered at the end idled too
+        stats["idle_seconds"] += sum(max(until - self._ready_at(p), 0) for p in self.bot.plants.values())
+        stats["rate"] = stats["commands"] / max(until - self.start, 1)
+        return stats
+
+    def _ready_at(self, plant: SimulatedPlant) -> float:
+        """
+        :return: the time the plant could be watered again at
+        """
+        return max(plant.last_watered + self.bot.cooldown, self.start)
+
+    def _worker(self, name: str):
+        def water():
+            now = self.clock()
+            plant = self.bot.plants.get(name)
+            ready_at = self._ready_at(plant) if plant is not None else now
+            reply = self.bot.reply(f"p.water {name}", now)
+            if name not in self.bot.plants:  # died before being watered
+                return None
+
+            self._count(now)
+            result = _parse_watering_message(reply)
+            if result[0]:
+                self.stats["watered"] += 1
+                self.stats["idle_seconds"] += now - ready_at
+            elif result[1] is not None:
+                self.stats["wasted"] += 1
+            return now + self.policy.next_delay(name, result, now)
+
+        return water
+
+    def _priority(self, name: str):
+        def priority() -> float:
+            plant = self.bot.plants.get(name)
+            if plant is None:
+                return float("-inf")  # dead, run it so it is dropped
+            return self.policy.rank(plant.death_at, plant.level, plant.max_level)
+
+        return priority
+
+    def _count(self, now: float):
+        self.stats["commands"] += 1
+        minute, count = self._minute
+        count = count + 1 if minute == now // 60 else 1
+        self._minute = (now // 60, count)
+        self.stats["peak_per_minute"] = max(self.stats["peak_per_minute"], count)
+
+
+class Simulator:
+    """
+    Serves the post message and list messages endpoints, storing the channel messages in memory and scheduling the
+    simulated bot replies with a configurable latency. Error responses, dropped requests and rate limits (with the
+    discord rate limit headers) can be injected. The messages can also be pushed on a gateway stand-in (see
+    GatewaySimulator).
+    Note the plants reply lists every plant in a single embed, to be usable with thousands of plants.
+    """
+
+    def __init__(self, plants: int = 10, latency: Tuple[float, float] = (.2, .6), error_rate: float = 0,
+                 rate_limit: Union[Tuple[int, float], None] = None, reference_rate: float = .5, ordered: bool = True,
+                 cooldown: float = 900, host: str = "127.0.0.1", port: int = 0, channel: str = "1",
+                 gateway_port: int = None, heartbeat_interval: float = 41.25, drop_rate: float = 0):
+        """
+        :param plants: the number of simulated plants
+        :param latency: (min, max) seconds the bot takes to reply
+        :param error_rate: probability of a request failing with a server error
+        :param rate_limit: (requests, window seconds) allowed per route, None to disable rate limits
+        :param reference_rate: probability of a bot reply referencing the command message
+        :param ordered: whether the bot replies in the order the commands were sent
+        :param cooldown: seconds a plant has to wait between waterings
+        :param host: the host to listen on
+        :param port: the port to listen on, 0 picks a free one
+        :param channel: the id of the simulated channel
+        :param gateway_port: the port to also serve a gateway pushing the channel messages on, 0 picks a free one,
+        None to not serve one
+        :param heartbeat_interval: seconds between the heartbeats the gateway asks for
+        :param drop_rate: probability of a request getting no response, its connection closed
+        """
+        self.bot = SimulatedBot(plants, cooldown)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.rate_limit = rate_limit
+        self.reference_rate = reference_rate
+        self.ordered = ordered
+        self.channel = channel
+
+        self.stats = {"posts": 0, "gets": 0, "errors": 0, "dropped": 0, "rate_limited": 0, "replies": 0}
+
+        self._messages: List[dict] = []
+        self._ids: List[int] = []  # ids of the messages, for searching
+        self._last_id = 0
+        self._windows: Dict[str, List[float]] = {}  # route -> [window reset time, remaining]
+        self._replies = []  # heap of (due, sequence, command message)
+        self._last_due = 0
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._cv = threading.Condition(self._lock)
+        self._closed = False
+
+        self.server = ThreadingHTTPServer((host, port), type("Handler", (_Handler,), {"simulator": self}))
+        self._threads = [threading.Thread(target=self.server.serve_forever, name="simulator-http", daemon=True),
+                         threading.Thread(target=self._run_bot, name="simulator-bot", daemon=True)]
+        self.gateway = None if gateway_port is None else GatewaySimulator(host, gateway_port, heartbeat_interval)
+
+    @property
+    def endpoint(self) -> str:
+        """
+        :return: the api endpoint to give the watering can
+        """
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/v8"
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        if self.gateway:
+            self.gateway.start()
+
+    def shutdown(self):
+        with self._cv:
+            self._closed = True
+            self._cv.notify()
+        self.server.shutdown()
+        self.server.server_close()
+        if self.gateway:
+            self.gateway.shutdown()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def post_message(self, content: str) -> dict:
+        with self._cv:
+            message = self._store({"author": {"username": "user", "id": USER_ID}, "content": content, "embeds": []})
+            due = time.time() + random.uniform(*self.latency)
+            if self.ordered:
+                due = self._last_due = max(due, self._last_due)
+            heapq.heappush(self._replies, (due, next(self._sequence), message))
+            self._cv.notify()
+        return message
+
+    def get_messages(self, after: int, limit: int) -> List[dict]:
+        with self._lock:
+            start = bisect.bisect_right(self._ids, after)
+            return self._messages[start:start + limit][::-1]  # newest first
+
+    def check_rate_limit(self, route: str) -> Tuple[bool, Dict[str, str]]:
+        """
+        Takes a slot of the route rate limit
+        :return: whether the request is allowed and its rate limit headers
+        """
+        if self.rate_limit is None:
+            return True, {}
+
+        limit, window = self.rate_limit
+        now = time.time()
+        with self._lock:
+            state = self._windows.setdefault(route, [now + window, limit])
+            if state[0] <= now:
+                state[:] = [now + window, limit]
+
+            allowed = state[1] > 0
+            state[1] = max(state[1] - 1, 0)
+            reset_after = state[0] - now
+
+        return allowed, {"X-RateLimit-Limit": str(limit), "X-RateLimit-Remaining": str(state[1]),
+                         "X-RateLimit-Reset-After": f"{reset_after:.3f}", "X-RateLimit-Bucket": route}
+
+    def _store(self, message: dict) -> dict:
+        self._last_id = max(self._last_id + 1, (int(time.time() * 1000) - DISCORD_EPOCH) << 22)
+        message = dict(message, id=str(self._last_id), channel_id=self.channel)
+        self._messages.append(message)
+        self._ids.append(self._last_id)
+        if self.gateway:
+            self.gateway.publish("MESSAGE_CREATE", message)
+        return message
+
+    def _run_bot(self):
+        with self._cv:
+            while not self._closed:
+                if not self._replies:
+                    self._cv.wait()
+                    continue
+
+                due, _, command = self._replies[0]
+                if due > time.time():
+                    self._cv.wait(due - time.time())
+                    continue
+
+                heapq.heappop(self._replies)
+                reply = self.bot.reply(command["content"], due)
+                if reply is None:
+                    continue
+
+                if random.random() < self.reference_rate:
+                    reply["message_reference"] = {"message_id": command["id"], "channel_id": self.channel}
+                self._store(reply)
+                self.stats["replies"] += 1  # the lock is held
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # allows keep-alive
+    disable_nagle_algorithm = True
+    wbufsize = -1  # headers and body go out in a single write
+    simulator: Simulator = None
+    _rate_limit_headers: Dict[str, str] = {}
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+        if self._check("POST"):
+            self.simulator.count("posts")
+            self._send(200, self.simulator.post_message(body.get("content", "")))
+
+    def do_GET(self):
+        if self._check("GET"):
+            self.simulator.count("gets")
+            query = parse_qs(urlparse(self.path).query)
+            after = int(query.get("after", ["0"])[0])
+            limit = min(int(query.get("limit", ["50"])[0]), 100)
+            self._send(200, self.simulator.get_messages(after, limit))
+
+    def _check(self, method: str) -> bool:
+        """
+        Validates the path and applies the injected errors and rate limits
+        :return: whether the request should be served
+        """
+        self._rate_limit_headers = {}
+
+        path = _messages_path.fullmatch(urlparse(self.path).path)
+        if not path or path["channel"] != self.simulator.channel:
+            self._send(404, {"message": "Unknown Channel", "code": 10003})
+            return False
+
+        allowed, self._rate_limit_headers = self.simulator.check_rate_limit(f"{method} {path[0]}")
+        if not allowed:
+            self.simulator.count("rate_limited")
+            retry_after = float(self._rate_limit_headers["X-RateLimit-Reset-After"])
+            self._send(429, {"message": "You are being rate limited.", "retry_after": retry_after, "global": False},
+                       {"Retry-After": str(retry_after)})
+            return False
+
+        if random.random() < self.simulator.drop_rate:
+            self.simulator.count("dropped")
+            self.close_connection = True
+            return False
+
+        if random.random() < self.simulator.error_rate:
+            self.simulator.count("errors")
+            self._send(500, {"message": "500: Internal Server Error", "code": 0})
+            return False
+
+        return True
+
+    def _send(self, status: int, body, headers: Dict[str, str] = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        for header, value in {**self._rate_limit_headers, **(headers or {})}.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class _GatewaySession(object):
+    """
+    A gateway session: the events dispatched on it, kept so a connection resuming it gets the ones it missed
+    """
+
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.sequence = 0
+        self.events: List[dict] = []
+        self.connection: Union["_GatewayConnection", None] = None
+
+
+class GatewaySimulator(object):
+    """
+    Stand-in for the discord gateway: a minimal websocket server saying hello, identifying and resuming sessions,
+    acknowledging heartbeats and dispatching the channel messages. The connection troubles the listener has to recover
+    from can be injected: reconnect requests, invalidated sessions, dropped connections and unacknowledged heartbeats.
+    """
+
+    MAX_EVENTS = 1000  # events kept per session for resuming
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, heartbeat_interval: float = 41.25):
+        """
+        :param host: the host to listen on
+        :param port: the port to listen on, 0 picks a free one
+        :param heartbeat_interval: seconds between the heartbeats asked for
+        """
+        self.heartbeat_interval = heartbeat_interval
+        self.ack_heartbeats = True  # False makes the connections zombies, their heartbeats are never acknowledged
+
+        self.stats = {"connections": 0, "identifies": 0, "resumes": 0, "heartbeats": 0, "dispatched": 0}
+
+        self._sessions: Dict[str, _GatewaySession] = {}
+        self._connections: List[_GatewayConnection] = []
+        self._lock = threading.RLock()
+
+        self.server = socketserver.ThreadingTCPServer((host, port), type("Handler", (_GatewayConnection,),
+                                                                         {"gateway": self}))
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name="simulator-gateway", daemon=True)
+
+    @property
+    def url(self) -> str:
+        """
+        :return: the gateway url to give the watering can
+        """
+        host, port = self.server.server_address[:2]
+        return f"ws://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+
+    def shutdown(self):
+        self.drop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def publish(self, event: str, data: dict):
+        """
+        Dispatches an event on every session, the sessions without a connection keep it until they are resumed
+        """
+        with self._lock:
+            for session in self._sessions.values():
+                self._dispatch(session, event, data)
+
+    def reconnect(self):
+        """
+        Asks every connection to reconnect (and resume)
+        """
+        self._send_all({"op": GatewayListener.RECONNECT, "d": None})
+
+    def invalidate(self, resumable: bool = False):
+        """
+        Invalidates every connected session, forgetting it unless resumable
+        """
+        with self._lock:
+            for connection in list(self._connections):
+                if connection.session is not None and not resumable:
+                    self._sessions.pop(connection.session.id, None)
+                connection.send({"op": GatewayListener.INVALID_SESSION, "d": resumable})
+
+    def drop(self):
+        """
+        Drops every connection without a close frame, like a network failure
+        """
+        with self._lock:
+            for connection in list(self._connections):
+                connection.abort()
+
+    def connected_sessions(self) -> int:
+        """
+        :return: the number of sessions identified or resumed on a live connection
+        """
+        with self._lock:
+            return sum(1 for session in self._sessions.values() if session.connection is not None)
+
+    def handle(self, connection: "_GatewayConnection", payload: dict):
+        op, data = payload.get("op"), payload.get("d")
+        with self._lock:
+            if op == GatewayListener.HEARTBEAT:
+                self.stats["heartbeats"] += 1
+                if self.ack_heartbeats:
+                    connection.send({"op": GatewayListener.HEARTBEAT_ACK, "d": None})
+            elif op == GatewayListener.IDENTIFY:
+                self.stats["identifies"] += 1
+                session = _GatewaySession(uuid.uuid4().hex)
+                self._sessions[session.id] = session
+                self._attach(connection, session)
+                self._dispatch(session, "READY", {"session_id": session.id, "resume_gateway_url": self.url,
+                                                  "user": {"username": "user", "id": USER_ID}})
+            elif op == GatewayListener.RESUME:
+                session = self._sessions.get(data.get("session_id"))
+                if session is None:
+                    connection.send({"op": GatewayListener.INVALID_SESSION, "d": False})
+                    return
+                self.stats["resumes"] += 1
+                self._attach(connection, session)
+                for event in session.events:
+                    if event["s"] > (data.get("seq") or 0):
+                        connection.send(event)
+                self._dispatch(session, "RESUMED", {})
+
+    def connected(self, connection: "_GatewayConnection"):
+        with self._lock:
+            self.stats["connections"] += 1
+            self._connections.append(connection)
+
+    def disconnected(self, connection: "_GatewayConnection"):
+        with self._lock:
+            self._connections.remove(connection)
+            if connection.session is not None and connection.session.connection is connection:
+                connection.session.connection = None
+
+    def _attach(self, connection: "_GatewayConnection", session: _GatewaySession):
+        if session.connection is not None and session.connection is not connection:
+            session.connection.abort()  # a session is only live on its latest connection
+        session.connection = connection
+        connection.session = session
+
+    def _dispatch(self, session: _GatewaySession, event: str, data: dict):
+        session.sequence += 1
+        payload = {"op": GatewayListener.DISPATCH, "t": event, "s": session.sequence, "d": data}
+        session.events = session.events[-self.MAX_EVENTS + 1:] + [payload]
+        if session.connection is not None:
+            self.stats["dispatched"] += 1
+            session.connection.send(payload)
+
+    def _send_all(self, payload: dict):
+        with self._lock:
+            for connection in list(self._connections):
+                connection.send(payload)
+
+
+class _GatewayConnection(socketserver.StreamRequestHandler):
+    """
+    A websocket connection to the gateway stand-in, text frames of JSON payloads only
+    """
+    gateway: GatewaySimulator = None
+    session: Union[_GatewaySession, None] = None
+
+    WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+    def handle(self):
+        if not self._handshake():
+            return
+
+        self._send_lock = threading.Lock()
+        self.gateway.connected(self)
+        try:
+            hello = {"heartbeat_interval": self.gateway.heartbeat_interval * 1000}
+            self.send({"op": GatewayListener.HELLO, "d": hello})
+            while True:
+                payload = self._receive()
+                if payload is None:
+                    return
+                self.gateway.handle(self, payload)
+        except (OSError, ValueError):
+            pass  # dropped
+        finally:
+            self.gateway.disconnected(self)
+
+    def send(self, payload: dict):
+        self._send_frame(0x1, json.dumps(payload).encode())
+
+    def abort(self):
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _handshake(self) -> bool:
+        self.rfile.readline()  # request line
+        headers = {}
+        for line in iter(self.rfile.readline, b"\r\n"):
+            if not line:
+                return False
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + self.WEBSOCKET_GUID).encode()).digest())
+        self.wfile.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                         b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        return True
+
+    def _receive(self) -> Union[dict, None]:
+        """
+        :return: the next payload, None once the connection is closed
+        """
+        while True:
+            header = self.rfile.read(2)
+            if len(header) < 2:
+                return None
+            opcode, length = header[0] & 0x0f, header[1] & 0x7f
+            if length == 126:
+                length = struct.unpack("!H", self.rfile.read(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", self.rfile.read(8))[0]
+            mask = self.rfile.read(4) if header[1] & 0x80 else bytes(4)
+            data = bytes(b ^ mask[i % 4] for i, b in enumerate(self.rfile.read(length)))
+
+            if opcode == 0x8:  # close, echoed back
+                self._send_frame(0x8, data[:2])
+                return None
+            if opcode == 0x9:  # ping
+                self._send_frame(0xa, data)
+            elif opcode == 0x1:
+                return json.loads(data)
+
+    def _send_frame(self, opcode: int, data: bytes):
+        if len(data) < 126:
+            header = struct.pack("!BB", 0x80 | opcode, len(data))
+        elif len(data) < 1 << 16:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, len(data))
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, len(data))
+        with self._send_lock:
+            try:
+                self.wfile.write(header + data)
+            except OSError:
+                pass  # the connection is being dropped, the reader notices
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--plants", type=int, default=10)
+    parser.add_argument("--latency", type=float, nargs=2, default=(.2, .6), metavar=("MIN", "MAX"))
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--rate-limit", type=float, nargs=2, default=None, metavar=("REQUESTS", "WINDOW"))
+    parser.add_argument("--cooldown", type=float, default=900)
+    parser.add_argument("--gateway-port", type=int, default=None, help="also push the messages on a gateway stand-in")
+    sim_args = parser.parse_args()
+
+    sim = Simulator(sim_args.plants, tuple(sim_args.latency), sim_args.error_rate,
+                    (int(sim_args.rate_limit[0]), sim_args.rate_limit[1]) if sim_args.rate_limit else None,
+                    cooldown=sim_args.cooldown, port=sim_args.port, gateway_port=sim_args.gateway_port)
+    sim.start()
+    print(f"Simulating {sim_args.plants} plants on {sim.endpoint}, channel {sim.channel}")
+    if sim.gateway:
+        print(f"Gateway on {sim.gateway.url}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sim.shutdown()
@@ -0,0 +1,88 @@
+from typing import Dict, List, Tuple, Union
+
+from botAPI import Plant
+
+import sqlite3
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class StateStore:
+    """
+    Keeps the plants and their watering deadlines in a local SQLite database, so a restart can resume from them
+    instead of checking every plant again
+    """
+
+    def __init__(self, path: str = "farm.db"):
+        """
+        :param path: the database file
+        """
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS plants (name TEXT PRIMARY KEY, type TEXT, level INTEGER, "
+                         "max_level INTEGER, death_timer, alive_time, start_sleep REAL, sleep_time REAL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+
+    def save_plants(self, plants: List[Plant]):
+        """
+        Replaces the stored plants, the deadlines of the plants still present are kept
+        :param plants: the user plants
+        """
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute(f"DELETE FROM plants WHERE name NOT IN ({','.join('?' * len(plants))})",
+                             [p.name for p in plants])
+            self._db.executemany(
+                "INSERT INTO plants (name, type, level, max_level, death_timer, alive_time) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET type=excluded.type, level=excluded.level, "
+                "max_level=excluded.max_level, death_timer=excluded.death_timer, alive_time=excluded.alive_time",
+                [(p.name, p.type, p.level, p.max_level, p.death_timer, p.alive_time) for p in plants])
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('plants_saved', ?)", (time.time(),))
+            self._db.execute("COMMIT")
+
+    def load_plants(self, max_age: float) -> Union[List[Plant], None]:
+        """
+        :param max_age: seconds after which the stored plants are considered stale
+        :return: the stored plants, None if they were never stored or are stale, their timers are as of when they
+        were stored
+        """
+        with self._lock:
+            saved = self._db.execute("SELECT value FROM meta WHERE key = 'plants_saved'").fetchone()
+            if saved is None or time.time() - saved[0] > max_age:
+                return None
+
+            rows = self._db.execute("SELECT name, type, level, max_level, death_timer, alive_time FROM plants")
+            plants = [Plant(*row, fetched_at=saved[0]) for row in rows]
+
+        # timers were kept as text before being parsed into seconds
+        if any(not isinstance(p.death_timer, int) for p in plants):
+            return None
+        return plants
+
+    def save_schedule(self, plant: Plant, start_sleep: float, sleep_time: float):
+        """
+        Stores the watering deadline of a plant, along with its nourishment level
+        :param plant: the plant
+        :param start_sleep: the time the plant cooldown started at
+        :param sleep_time: the plant cooldown in seconds
+        """
+        with self._lock:
+            self._db.execute("UPDATE plants SET level = ?, start_sleep = ?, sleep_time = ? WHERE name = ?",
+                             (plant.level, start_sleep, sleep_time, plant.name))
+
+    def load_schedules(self) -> Dict[str, Tuple[float, float]]:
+        """
+        :return: the stored deadlines, as {plant name: (start_sleep, sleep_time)}
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT name, start_sleep, sleep_time FROM plants WHERE start_sleep IS NOT NULL")
+            return {name: (start_sleep, sleep_time) for name, start_sleep, sleep_time in rows}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
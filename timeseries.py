@@ -0,0 +1,217 @@
+"""
+Compact history of the exp, for exp rates over time. Samples are downsampled into fixed size ring buffers of minute,
+hour and day buckets, kept in a small memory mapped file so the history survives restarts (about 46KB with the default
+tiers, covering a day of minutes, a month of hours and two years of days).
+The exp earned is stored rather than the exp itself, so spending exp in the shop does not show as a negative rate.
+"""
+from collections import deque
+from collections.abc import Sequence
+from typing import List, Tuple, Union
+
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("<8sdd")  # magic, last exp seen, exp earned
+_TIER_HEADER = struct.Struct("<dQQ")  # resolution, capacity, buckets ever added
+_MAGIC = b"FLWEXP01"
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+class _Tier(Sequence):
+    """
+    A ring buffer of (bucket start, exp earned by the end of the bucket) pairs, in a slice of the mapped file. As a
+    sequence it gives the bucket start times, oldest first, for bisecting.
+    """
+
+    def __init__(self, buffer: mmap.mmap, offset: int):
+        self._buffer = buffer
+        self._offset = offset
+        self.resolution, self.capacity, self.added = _TIER_HEADER.unpack_from(buffer, offset)
+        start = offset + _TIER_HEADER.size
+        self._slots = memoryview(buffer)[start:start + self.capacity * 16].cast("d")
+
+    @staticmethod
+    def size(capacity: int) -> int:
+        return _TIER_HEADER.size + capacity * 16
+
+    def __len__(self):
+        return min(self.added, self.capacity)
+
+    def __getitem__(self, i: int) -> float:
+        return self._slots[self._slot(i)]
+
+    def value(self, i: int) -> float:
+        return self._slots[self._slot(i) + 1]
+
+    def add(self, when: float, earned: float) -> bool:
+        """
+        :param when: the sample time
+        :param earned: the exp earned by then
+        :return: whether the sample started a new bucket
+        """
+        start = when - when % self.resolution
+        if len(self) and self[-1] == start:
+            self._slots[self._slot(-1) + 1] = earned
+            return False
+
+        slot = self.added % self.capacity * 2
+        self._slots[slot], self._slots[slot + 1] = start, earned
+        self.added += 1
+        _TIER_HEADER.pack_into(self._buffer, self._offset, self.resolution, self.capacity, self.added)
+        return True
+
+    def at_or_before(self, when: float) -> Union[int, None]:
+        """
+        :return: the position of the last bucket starting at or before the given time, None if there is none
+        """
+        i = bisect.bisect_right(self, when) - 1
+        return i if i >= 0 else None
+
+    def _slot(self, i: int) -> int:
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError(i)
+        return (self.added - n + i) % self.capacity * 2
+
+    def release(self):
+        self._slots.release()
+
+
+class ExpHistory(object):
+    """
+    Keeps the exp samples in tiers of growing resolution, giving exp rates over windows of up to the longest tier and
+    an hourly sparkline, both without going through the history
+    """
+
+    TIERS = ((60, 24 * 60), (3600, 30 * 24), (86400, 2 * 365))  # (bucket seconds, buckets kept)
+
+    def __init__(self, path: str = None, tiers: Tuple[Tuple[int, int], ...] = TIERS, spark_width: int = 48):
+        """
+        :param path: the file the history is kept in, None to only keep it in memory
+        :param tiers: the (bucket seconds, buckets kept) of each tier, finest first
+        :param spark_width: how many hourly buckets the sparkline shows
+        """
+        self.path = path
+        size = _HEADER.size + sum(_Tier.size(capacity) for _, capacity in tiers)
+        self._buffer = self._map(path, size, tiers)
+        self._lock = threading.Lock()
+
+        self.tiers: List[_Tier] = []
+        offset = _HEADER.size
+        for _, capacity in tiers:
+            self.tiers.append(_Tier(self._buffer, offset))
+            offset += _Tier.size(capacity)
+        _, self.last_exp, self.earned = _HEADER.unpack_from(self._buffer, 0)
+
+        # exp earned per hour, kept up to date as samples come in (the newest hour is the one in progress)
+        self._hourly = self._tier(3600)
+        self._spark = deque(maxlen=spark_width)
+        if self._hourly is not None:
+            n = len(self._hourly)
+            for i in range(max(n - spark_width, 0), n):
+                self._spark.append(self._hourly.value(i) - (self._hourly.value(i - 1) if i else self._hourly.value(i)))
+
+    def add(self, when: float, exp: int):
+        """
+        Records an exp sample
+        :param when: the sample time
+        :param exp: the exp at that time
+        """
+        with self._lock:
+            if self.last_exp >= 0:
+                self.earned += max(exp - self.last_exp, 0)  # a drop is exp spent
+            self.last_exp = exp
+            _HEADER.pack_into(self._buffer, 0, _MAGIC, self.last_exp, self.earned)
+
+            for tier in self.tiers:
+                if tier.add(when, self.earned) and tier is self._hourly:
+                    self._spark.append(0)
+            if self._hourly is not None and len(self._hourly):
+                previous = self._hourly.value(-2) if len(self._hourly) > 1 else self._hourly.value(-1)
+                self._spark[-1] = self.earned - previous
+
+    def rate(self, window: float, now: float = None) -> Union[float, None]:
+        """
+        :param window: seconds to average over
+        :param now: the end of the window, the current time by default
+        :return: the exp earned per hour over the window (or over the history available, if shorter), None if there
+        are not enough samples
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            # the finest tier covering the window, or the longest one
+            tier = next((t for t in self.tiers if t.resolution * t.capacity >= window), self.tiers[-1])
+            latest = self.tiers[0]
+            if len(latest) == 0:
+                return None
+
+            i = tier.at_or_before(now - window)
+            i = 0 if i is None else i
+            elapsed = latest[-1] + latest.resolution - tier[i] - tier.resolution  # between the buckets ends
+            if elapsed <= 0:
+                return None
+            return (latest.value(-1) - tier.value(i)) / elapsed * 3600
+
+    def sparkline(self) -> str:
+        """
+        :return: the exp earned per hour over the last hours, oldest first, as block characters
+        """
+        with self._lock:
+            values = list(self._spark)
+        top = max(values, default=0)
+        if top <= 0:
+            return SPARK_CHARS[0] * len(values)
+        return "".join(SPARK_CHARS[min(int(value / top * len(SPARK_CHARS)), len(SPARK_CHARS) - 1)] for value in values)
+
+    def close(self):
+        with self._lock:
+            for tier in self.tiers:
+                tier.release()
+            self._buffer.flush()
+            self._buffer.close()
+
+    def _tier(self, resolution: float) -> Union[_Tier, None]:
+        return next((tier for tier in self.tiers if tier.resolution == resolution), None)
+
+    @staticmethod
+    def _map(path: Union[str, None], size: int, tiers: Tuple[Tuple[int, int], ...]) -> mmap.mmap:
+        """
+        Maps the history file, starting a new history if it is missing or was written with other tiers
+        """
+        if path is None:
+            buffer = mmap.mmap(-1, size)
+        else:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fresh = os.fstat(fd).st_size != size
+                if fresh:
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, size)
+                buffer = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+
+            layout = [_TIER_HEADER.unpack_from(buffer, _HEADER.size + sum(_Tier.size(c) for _, c in tiers[:i]))[:2]
+                      for i in range(len(tiers))]
+            if not fresh and buffer[:len(_MAGIC)] == _MAGIC and layout == [(float(r), c) for r, c in tiers]:
+                return buffer
+            if not fresh:
+                log.warning("Exp history in %s has another layout, starting a new one", path)
+            buffer[:] = bytes(size)
+
+        _HEADER.pack_into(buffer, 0, _MAGIC, -1, 0)
+        offset = _HEADER.size
+        for resolution, capacity in tiers:
+            _TIER_HEADER.pack_into(buffer, offset, resolution, capacity, 0)
+            offset += _Tier.size(capacity)
+        return buffer